@@ -0,0 +1,15 @@
+"""
+Microbenchmarks and regression checks for the RAG hot paths.
+
+    uv run python -m bench list
+    uv run python -m bench run                      # writes bench/results/latest.json
+    uv run python -m bench run --only search parse --quick
+    uv run python -m bench compare                  # latest results vs bench/baseline.json
+    uv run python -m bench run --compare            # run, compare, exit 1 on regressions
+                                                    # or benchmarks without a baseline
+    uv run python -m bench run --save-baseline      # record a new baseline
+
+Runs offline and CPU-only: HF_HUB_OFFLINE is set and CUDA is hidden, so
+the embedding benchmarks use the locally cached model (python -m
+src.retriever) or are skipped.
+"""
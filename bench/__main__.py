@@ -0,0 +1,149 @@
+import os
+
+# Before anything imports torch or huggingface_hub: no downloads, no GPU.
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import argparse
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from bench import suite
+from bench.harness import (
+    BENCHMARKS,
+    DEFAULT_THRESHOLD,
+    compare,
+    format_comparison,
+    has_regressions,
+    unbaselined,
+    load_results,
+    merge_runs,
+    run_suite,
+    save_results,
+)
+
+BENCH_DIR = Path(suite.__file__).resolve().parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+RESULTS_PATH = BENCH_DIR / "results" / "latest.json"
+# Runs, each in its own process, pooled into a baseline (see merge_runs).
+BASELINE_RUNS = 3
+
+
+def select(only):
+    if not only:
+        return list(BENCHMARKS)
+    return [b for b in BENCHMARKS if any(b.name.startswith(prefix) for prefix in only)]
+
+
+def print_comparison(
+    baseline_path: Path, current: dict, threshold: float, require_baseline: bool = False
+) -> int:
+    baseline = load_results(baseline_path)
+    rows = compare(baseline, current, threshold)
+    print(format_comparison(rows, baseline, current, threshold))
+    status = 0
+    if has_regressions(rows):
+        print("\nRegressions found.")
+        status = 1
+    missing = unbaselined(rows)
+    if missing:
+        print(
+            f"\nNo baseline for: {', '.join(missing)}; not checked. Record it with "
+            "`run --save-baseline` on the reference machine."
+        )
+        if require_baseline:
+            status = 1
+    return status
+
+
+def baseline_runs(first: dict, only, quick: bool) -> list[dict]:
+    """`first` and BASELINE_RUNS - 1 more runs of the same benchmarks in new processes."""
+    runs = [first]
+    with tempfile.TemporaryDirectory() as tmp:
+        for number in range(2, BASELINE_RUNS + 1):
+            print(f"\nBaseline run {number}/{BASELINE_RUNS} in a new process")
+            output = Path(tmp) / f"run{number}.json"
+            command = [sys.executable, "-m", "bench", "run", "-o", str(output)]
+            if only:
+                command += ["--only", *only]
+            if quick:
+                command.append("--quick")
+            subprocess.run(command, cwd=BENCH_DIR.parent, check=True)
+            runs.append(load_results(output))
+    return runs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="List benchmarks")
+
+    run = commands.add_parser("run", help="Run benchmarks")
+    run.add_argument("--only", nargs="+", help="Name prefixes, e.g. search parse")
+    run.add_argument("--quick", action="store_true", help="5x fewer iterations, 3 rounds")
+    run.add_argument("-o", "--output", type=Path, default=RESULTS_PATH)
+    run.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"Also write {BASELINE_PATH}, pooled from {BASELINE_RUNS} runs",
+    )
+    run.add_argument("--compare", action="store_true", help="Compare with the baseline afterwards")
+    run.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run.add_argument(
+        "--require-baseline", action="store_true", help="Fail on benchmarks that ran without a baseline"
+    )
+
+    cmp = commands.add_parser("compare", help="Compare results with the baseline")
+    cmp.add_argument("results", type=Path, nargs="?", default=RESULTS_PATH)
+    cmp.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    cmp.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Relative throughput drop / p50 increase flagged as a regression (default: 0.15)",
+    )
+    cmp.add_argument(
+        "--require-baseline", action="store_true", help="Fail on benchmarks that ran without a baseline"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for bench in BENCHMARKS:
+            print(f"{bench.name:<24} {bench.description}")
+        return 0
+
+    if args.command == "compare":
+        return print_comparison(
+            args.baseline, load_results(args.results), args.threshold, args.require_baseline
+        )
+
+    selected = select(args.only)
+    if not selected:
+        print(f"No benchmarks match {args.only}", file=sys.stderr)
+        return 2
+    results = run_suite(selected, quick=args.quick)
+    save_results(results, args.output)
+    print(f"\nResults saved to {args.output}")
+    if args.save_baseline:
+        baseline = merge_runs(baseline_runs(results, args.only, args.quick))
+        save_results(baseline, args.baseline)
+        print(f"\nBaseline of {BASELINE_RUNS} runs saved to {args.baseline}")
+        if results["skipped"]:
+            print(
+                f"warning: the baseline does not cover skipped benchmarks: "
+                f"{', '.join(results['skipped'])}"
+            )
+    if args.compare:
+        print()
+        return print_comparison(args.baseline, results, args.threshold, args.require_baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
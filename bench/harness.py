@@ -0,0 +1,351 @@
+"""
+Timing, result files and baseline comparison for the benchmark suite.
+
+Every benchmark runs REPEATS rounds of its iterations after the warm-up,
+interleaved with the other benchmarks (see run_suite()), and reports the
+median of the rounds. The spread of the round medians is kept as the
+benchmark's noise. compare() factors out the suite-wide change of the median
+time (machine_shift()) and flags a benchmark whose median time then rises by
+more than the threshold and by more than NOISE_FACTOR times its noise.
+A baseline pools the rounds of several runs in separate processes
+(merge_runs()), so its noise also covers what differs between processes.
+"""
+
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, ContextManager, Optional
+
+DEFAULT_THRESHOLD = 0.15
+REPEATS = 7
+# Changes within this many noise widths (relative MAD of the round medians)
+# are not flagged.
+NOISE_FACTOR = 3
+# Fewest compared benchmarks from which machine_shift() is factored out.
+SHIFT_MIN_BENCHMARKS = 5
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark setup when its inputs or dependencies are unavailable."""
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # Context manager yielding the operation to time; the operation returns
+    # the number of items it processed (queries, protocols, answers, ...).
+    setup: Callable[[], ContextManager[Callable[[], int]]]
+    iterations: int
+    warmup: int
+    unit: str
+    description: str
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, iterations: int, unit: str, warmup: int = 3):
+    """Registers a context-manager setup function as a benchmark."""
+
+    def register(setup):
+        BENCHMARKS.append(
+            Benchmark(
+                name=name,
+                setup=setup,
+                iterations=iterations,
+                warmup=warmup,
+                unit=unit,
+                description=(setup.__doc__ or "").strip().splitlines()[0],
+            )
+        )
+        return setup
+
+    return register
+
+
+def percentile(values: list[float], q: int) -> float:
+    """q-th percentile (1..99); the maximum for small samples."""
+    if len(values) < 20:
+        return max(values)
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def relative_mad(values: list[float]) -> float:
+    """Median absolute deviation relative to the median."""
+    median = statistics.median(values)
+    if not median:
+        return 0.0
+    return statistics.median(abs(v - median) for v in values) / median
+
+
+def time_round(operation: Callable[[], int], iterations: int) -> tuple[list[float], int]:
+    """One round: (per-iteration durations in seconds, items processed)."""
+    gc.collect()
+    durations = []
+    items = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        items += operation()
+        durations.append(time.perf_counter() - start)
+    return durations, items
+
+
+def summarize(bench: Benchmark, rounds: list[tuple[list[float], int]]) -> dict:
+    medians = [statistics.median(durations) for durations, _ in rounds]
+    throughputs = [items / sum(durations) for durations, items in rounds if sum(durations)]
+    every = [d for durations, _ in rounds for d in durations]
+    return {
+        "iterations": len(rounds[0][0]),
+        "repeats": len(rounds),
+        "unit": bench.unit,
+        "throughput_per_s": round(statistics.median(throughputs), 2) if throughputs else None,
+        "mean_ms": round(statistics.mean(every) * 1000, 3),
+        "p50_ms": round(statistics.median(medians) * 1000, 3),
+        "p95_ms": round(statistics.median(percentile(d, 95) for d, _ in rounds) * 1000, 3),
+        "noise": round(relative_mad(medians), 4),
+        "rounds_p50_ms": [round(m * 1000, 3) for m in medians],
+    }
+
+
+def merge_runs(runs: list[dict]) -> dict:
+    """One result from runs of the suite in separate processes, their rounds pooled.
+
+    Part of the variation only shows between processes (hash seeds, memory
+    layout), so a baseline's noise is taken over the rounds of all its runs.
+    """
+    benchmarks = {}
+    for name, first in runs[0]["benchmarks"].items():
+        results = [run["benchmarks"][name] for run in runs if name in run["benchmarks"]]
+        rounds = [p50 for result in results for p50 in result["rounds_p50_ms"]]
+        throughputs = [r["throughput_per_s"] for r in results if r["throughput_per_s"] is not None]
+        benchmarks[name] = {
+            "iterations": first["iterations"],
+            "repeats": len(rounds),
+            "runs": len(results),
+            "unit": first["unit"],
+            "throughput_per_s": round(statistics.median(throughputs), 2) if throughputs else None,
+            "mean_ms": round(statistics.mean(r["mean_ms"] for r in results), 3),
+            "p50_ms": round(statistics.median(rounds), 3),
+            "p95_ms": round(statistics.median(r["p95_ms"] for r in results), 3),
+            "noise": round(relative_mad(rounds), 4),
+            "rounds_p50_ms": rounds,
+        }
+    return {
+        "environment": runs[0]["environment"],
+        "benchmarks": benchmarks,
+        "skipped": runs[0]["skipped"],
+    }
+
+
+def environment() -> dict:
+    """Machine description stored with results; comparisons across machines are flagged."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_suite(selected: list[Benchmark], quick: bool = False, log=print) -> dict:
+    """Sets up and warms up every benchmark, then runs their rounds interleaved.
+
+    Round r of every benchmark runs before round r + 1 of any, so each
+    benchmark's rounds are spread over the whole run. The median then
+    smooths out, and the noise captures, drift of the machine's speed; back
+    to back rounds all see the same state.
+    Garbage left by the setups is collected before every round: otherwise
+    the benchmark after a large setup pays for it in every collection.
+    """
+    iterations = {
+        bench.name: max(3, bench.iterations // 5) if quick else bench.iterations
+        for bench in selected
+    }
+    repeats = 3 if quick else REPEATS
+    operations, rounds, skipped = {}, {}, {}
+    with ExitStack() as stack:
+        for bench in selected:
+            try:
+                operation = stack.enter_context(bench.setup())
+            except SkipBenchmark as e:
+                skipped[bench.name] = str(e)
+                log(f"{bench.name:<24} skipped: {e}")
+                continue
+            for _ in range(bench.warmup):
+                operation()
+            operations[bench.name] = operation
+            rounds[bench.name] = []
+        for repeat in range(repeats):
+            log(f"round {repeat + 1}/{repeats}", flush=True)
+            for name, operation in operations.items():
+                rounds[name].append(time_round(operation, iterations[name]))
+
+    results = {}
+    for bench in selected:
+        if bench.name not in rounds:
+            continue
+        result = results[bench.name] = summarize(bench, rounds[bench.name])
+        log(
+            f"{bench.name:<24} {result['throughput_per_s']:>12,.1f} {bench.unit}/s"
+            f"   p50 {result['p50_ms']:>10.3f} ms   p95 {result['p95_ms']:>10.3f} ms"
+            f"   noise {result['noise'] * 100:>4.1f}%"
+        )
+    return {"environment": environment(), "benchmarks": results, "skipped": skipped}
+
+
+def save_results(results: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def load_results(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _change(current: float, baseline: Optional[float]) -> Optional[float]:
+    if not baseline or current is None:
+        return None
+    return current / baseline - 1
+
+
+def tolerance(base: dict, result: dict, threshold: float) -> float:
+    """Relative change a benchmark may show before it is flagged."""
+    noise = max(base.get("noise", 0.0), result.get("noise", 0.0))
+    return max(threshold, NOISE_FACTOR * noise)
+
+
+def machine_shift(baseline: dict, current: dict) -> Optional[float]:
+    """Median p50 change over the benchmarks in both results: the machine's drift.
+
+    None when fewer than SHIFT_MIN_BENCHMARKS can be compared (e.g. run
+    --only), since the median of a few would absorb a real regression.
+    """
+    base_benchmarks = baseline.get("benchmarks", {})
+    changes = [
+        _change(result["p50_ms"], base_benchmarks[name]["p50_ms"])
+        for name, result in current.get("benchmarks", {}).items()
+        if name in base_benchmarks
+    ]
+    changes = [change for change in changes if change is not None]
+    if len(changes) < SHIFT_MIN_BENCHMARKS:
+        return None
+    return statistics.median(changes)
+
+
+def compare(baseline: dict, current: dict, threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """Per-benchmark comparison rows; status is ok, improved, REGRESSION, NO BASELINE,
+    skipped or missing.
+
+    The median time (p50) of every benchmark is compared after factoring
+    out machine_shift(): the same code measured a few minutes apart on a
+    shared machine can be slower or faster as a whole, and that must not
+    count as a regression of each benchmark. A regression is an adjusted
+    rise by more than tolerance(): `threshold`, widened for noisy
+    benchmarks. Throughput and p95 are reported but not gated on; a single
+    slow iteration moves p95. NO BASELINE marks a benchmark that ran but
+    could not be checked; skipped marks one skipped in this run with no
+    baseline either.
+    """
+    shift = machine_shift(baseline, current) or 0.0
+    rows = []
+    base_benchmarks = baseline.get("benchmarks", {})
+    for name, result in current.get("benchmarks", {}).items():
+        base = base_benchmarks.get(name)
+        if base is None:
+            rows.append({"name": name, "status": "NO BASELINE"})
+            continue
+        allowed = tolerance(base, result, threshold)
+        p50 = _change(result["p50_ms"], base["p50_ms"])
+        adjusted = None if p50 is None else (1 + p50) / (1 + shift) - 1
+        if adjusted is not None and adjusted > allowed:
+            status = "REGRESSION"
+        elif adjusted is not None and adjusted < -allowed:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append(
+            {
+                "name": name,
+                "status": status,
+                "tolerance": allowed,
+                "throughput_change": _change(result["throughput_per_s"], base["throughput_per_s"]),
+                "p50_change": p50,
+                "adjusted_change": adjusted,
+                "baseline_p50_ms": base["p50_ms"],
+                "p50_ms": result["p50_ms"],
+                "p95_change": _change(result["p95_ms"], base["p95_ms"]),
+            }
+        )
+    for name in current.get("skipped", {}):
+        if name not in base_benchmarks:
+            rows.append({"name": name, "status": "skipped"})
+    for name in base_benchmarks:
+        if name not in current.get("benchmarks", {}):
+            rows.append({"name": name, "status": "missing"})
+    return rows
+
+
+def format_comparison(rows: list[dict], baseline: dict, current: dict, threshold: float) -> str:
+    def pct(value):
+        return "" if value is None else f"{value * 100:+.1f}%"
+
+    lines = []
+    base_env, env = baseline.get("environment", {}), current.get("environment", {})
+    for key in ("machine", "cpu_count", "python"):
+        if base_env.get(key) != env.get(key):
+            lines.append(
+                f"warning: baseline was recorded with {key}={base_env.get(key)}, "
+                f"current run has {key}={env.get(key)}"
+            )
+    shift = machine_shift(baseline, current)
+    if shift is None:
+        shift_note = f"machine shift not factored out (fewer than {SHIFT_MIN_BENCHMARKS} benchmarks)"
+    else:
+        shift_note = f"machine shift {pct(shift)} factored out (median p50 change)"
+    lines.append(
+        f"threshold: {threshold * 100:.0f}% (wider for noisy benchmarks, see tolerance); {shift_note}"
+    )
+    lines.append(
+        f"{'benchmark':<24} {'p50 base':>12} {'p50 now':>12} {'p50':>9} {'adjusted':>9}"
+        f" {'tolerance':>10} {'throughput':>11} {'p95':>9}  status"
+    )
+    for row in rows:
+        if "p50_ms" in row:
+            lines.append(
+                f"{row['name']:<24} {row['baseline_p50_ms']:>9.3f} ms {row['p50_ms']:>9.3f} ms"
+                f" {pct(row['p50_change']):>9} {pct(row['adjusted_change']):>9}"
+                f" {row['tolerance'] * 100:>9.0f}% {pct(row['throughput_change']):>11}"
+                f" {pct(row['p95_change']):>9}  {row['status']}"
+            )
+        else:
+            lines.append(f"{row['name']:<24} {'':>81}  {row['status']}")
+    return "\n".join(lines)
+
+
+def has_regressions(rows: list[dict]) -> bool:
+    return any(row["status"] == "REGRESSION" for row in rows)
+
+
+def unbaselined(rows: list[dict]) -> list[str]:
+    return [row["name"] for row in rows if row["status"] == "NO BASELINE"]
@@ -0,0 +1,504 @@
+"""
+Benchmarks of the paths that decide /diagnose latency.
+
+All inputs are fixed: synthetic data from seeded generators and the
+protocols in rag/test_set. Nothing is downloaded; benchmarks whose
+dependencies, embedding model (local HF cache) or index are missing are
+skipped with the reason.
+"""
+
+import asyncio
+import atexit
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench.harness import SkipBenchmark, benchmark
+
+ROOT = Path(__file__).resolve().parent.parent
+RAG_DIR = ROOT / "rag"
+TEST_SET_DIR = RAG_DIR / "test_set"
+SEED = 1234
+
+SEARCH_POINTS = 5000
+SEARCH_DIM = 1024
+SEARCH_QUERIES = 64
+PARSE_ANSWERS = 200
+EMBED_BATCH = 16
+
+CODES = [
+    "I10", "I20.0", "I21.4", "J18.9", "J45.0", "K35.8", "K80.0", "E11.9",
+    "N39.0", "M54.5", "G43.0", "S72.0", "O14.1", "A09", "L40.0", "F32.1",
+]
+
+
+def require(*modules):
+    for module in modules:
+        if importlib.util.find_spec(module) is None:
+            raise SkipBenchmark(f"{module} is not installed")
+
+
+def load_test_cases() -> list[dict]:
+    cases = []
+    for path in sorted(TEST_SET_DIR.glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            cases.append(json.load(f))
+    if not cases:
+        raise SkipBenchmark(f"no test cases in {TEST_SET_DIR}")
+    return cases
+
+
+def queries(cases: list[dict]) -> list[str]:
+    return [case["query"] for case in cases if case.get("query")]
+
+
+def _rag_imports():
+    if str(RAG_DIR) not in sys.path:
+        sys.path.insert(0, str(RAG_DIR))
+
+
+def _embeddings():
+    """The server's embedding model, from the local HF cache only."""
+    require("langchain_huggingface", "sentence_transformers")
+    from src.retriever import get_embeddings
+
+    try:
+        return get_embeddings()
+    except OSError as e:
+        raise SkipBenchmark(
+            f"embedding model is not in the local HF cache (python -m src.retriever): {e}"
+        )
+
+
+# --- LLM-response parsing -----------------------------------------------
+
+
+def synthetic_answers(rng: random.Random, count: int) -> list[str]:
+    answers = []
+    for _ in range(count):
+        codes = rng.sample(CODES, 3)
+        answers.append(
+            json.dumps(
+                {
+                    "diagnoses": [
+                        {
+                            "rank": rank,
+                            "diagnosis": f"Диагноз {code}",
+                            "icd10_code": code,
+                            "explanation": "Соответствует симптомам и протоколу. " * rng.randint(1, 6),
+                        }
+                        for rank, code in enumerate(codes, 1)
+                    ]
+                },
+                ensure_ascii=False,
+            )
+        )
+    return answers
+
+
+def malformed(answer: str, rng: random.Random) -> str:
+    """The broken shapes seen from real models (cf. src/mock_llm_server.malform)."""
+    kind = rng.choice(["truncated", "fenced", "trailing", "renamed", "cyrillic"])
+    if kind == "truncated":
+        return answer[: int(len(answer) * rng.uniform(0.5, 0.9))]
+    if kind == "fenced":
+        return f"Вот ответ:\n```json\n{answer}\n```"
+    if kind == "trailing":
+        return f"{answer}\nНадеюсь, это поможет."
+    if kind == "renamed":
+        return answer.replace('"diagnoses"', '"diagnosis_list"', 1).replace('"icd10_code"', '"code"')
+    # Cyrillic look-alikes instead of Latin letters in the codes.
+    return answer.replace('"K', '"К').replace('"E', '"Е')
+
+
+@benchmark("parse.clean", iterations=200, unit="answers")
+@contextmanager
+def parse_clean():
+    """Parsing well-formed LLM answers."""
+    from src.parsing import parse_diagnoses
+
+    answers = synthetic_answers(random.Random(SEED), PARSE_ANSWERS)
+    code_index = frozenset(CODES) | {code[:3] for code in CODES}
+
+    def operation():
+        for answer in answers:
+            parse_diagnoses(answer, code_index=code_index)
+        return len(answers)
+
+    yield operation
+
+
+@benchmark("parse.salvage", iterations=200, unit="answers")
+@contextmanager
+def parse_salvage():
+    """Parsing malformed LLM answers (truncated, fenced, renamed keys, ...)."""
+    from src.parsing import DiagnosesParseError, parse_diagnoses
+
+    rng = random.Random(SEED)
+    answers = [malformed(a, rng) for a in synthetic_answers(rng, PARSE_ANSWERS)]
+    code_index = frozenset(CODES) | {code[:3] for code in CODES}
+
+    def operation():
+        for answer in answers:
+            try:
+                parse_diagnoses(answer, code_index=code_index)
+            except DiagnosesParseError:
+                pass
+        return len(answers)
+
+    yield operation
+
+
+# --- Prompt assembly ----------------------------------------------------
+
+
+def synthetic_patient():
+    """Same attributes as PatientData in src/llm_server.py."""
+    return SimpleNamespace(
+        name="Пациент",
+        age=54,
+        gender="female",
+        medicalHistory=["артериальная гипертензия", "сахарный диабет 2 типа"],
+        currentMedications=["метформин", "лизиноприл"],
+        allergies=["пенициллин"],
+        recentLabs=[
+            {"name": "Глюкоза", "value": 8.1, "unit": "ммоль/л", "normalRange": "3.9-6.1"},
+            {"name": "Креатинин", "value": 96, "unit": "мкмоль/л", "normalRange": "44-97"},
+        ],
+        previousDiagnoses=[{"diagnosis": "Гипертоническая болезнь", "date": "2023-04-01"}],
+    )
+
+
+@benchmark("prompt.assemble", iterations=200, unit="prompts")
+@contextmanager
+def prompt_assemble():
+    """Building the /diagnose prompt from 10 retrieved chunks and full patient data."""
+    from src.prompts import build_prompt
+
+    cases = load_test_cases()
+    rng = random.Random(SEED)
+    chunks = []
+    for i in range(10):
+        text = cases[i % len(cases)]["text"]
+        start = rng.randrange(max(1, len(text) - 1000))
+        chunks.append(text[start : start + 1000])
+    texts = queries(cases)
+    patient = synthetic_patient()
+
+    def operation():
+        # 100 prompts per iteration: a single one is too short to time reliably.
+        for i in range(100):
+            context_str = "\n\n".join(dict.fromkeys(chunks))
+            build_prompt(texts[i % len(texts)], patient, context_str)
+        return 100
+
+    yield operation
+
+
+# --- Query embedding ----------------------------------------------------
+
+
+@benchmark("embed.query", iterations=50, unit="queries")
+@contextmanager
+def embed_query():
+    """Embedding one query with the server's e5-large model."""
+    embeddings = _embeddings()
+    texts = queries(load_test_cases())
+    position = 0
+
+    def operation():
+        nonlocal position
+        embeddings.embed_query(texts[position % len(texts)])
+        position += 1
+        return 1
+
+    yield operation
+
+
+@benchmark("embed.batch16", iterations=20, unit="queries")
+@contextmanager
+def embed_batch():
+    """Embedding a batch of 16 queries, as src.retrieval_worker does."""
+    embeddings = _embeddings()
+    texts = queries(load_test_cases())
+    batch = [texts[i % len(texts)] for i in range(EMBED_BATCH)]
+
+    def operation():
+        embeddings.embed_documents(batch)
+        return len(batch)
+
+    yield operation
+
+
+# --- Vector search ------------------------------------------------------
+
+
+_collection = None
+
+
+def synthetic_collection():
+    """In-memory Qdrant collection of seeded random vectors with patient tags.
+
+    Built once and shared by the search benchmarks. Search time depends on
+    where the allocator put the 20 MB of vectors (the first large array gets
+    fresh mmap pages, later ones reuse the heap), so a collection per
+    benchmark made whichever ran first the slowest.
+    """
+    global _collection
+    if _collection is None:
+        _collection = _build_collection()
+    return _collection
+
+
+def _build_collection():
+    require("qdrant_client", "numpy")
+    import numpy as np
+    from qdrant_client import QdrantClient, models
+
+    rng = np.random.default_rng(SEED)
+    vectors = rng.standard_normal((SEARCH_POINTS, SEARCH_DIM), dtype=np.float32)
+    tags = random.Random(SEED)
+    client = QdrantClient(location=":memory:")
+    client.create_collection(
+        "bench",
+        vectors_config=models.VectorParams(size=SEARCH_DIM, distance=models.Distance.COSINE),
+    )
+    for start in range(0, SEARCH_POINTS, 500):
+        client.upsert(
+            "bench",
+            points=[
+                models.PointStruct(
+                    id=i,
+                    vector=vectors[i].tolist(),
+                    payload={
+                        "metadata": {
+                            "age_group": tags.choice(["all", "all", "adult", "pediatric"]),
+                            "sex": tags.choice(["all", "all", "all", "female", "male"]),
+                        }
+                    },
+                )
+                for i in range(start, min(start + 500, SEARCH_POINTS))
+            ],
+        )
+    query_vectors = [
+        v.tolist() for v in rng.standard_normal((SEARCH_QUERIES, SEARCH_DIM), dtype=np.float32)
+    ]
+    atexit.register(client.close)
+    return client, query_vectors
+
+
+def _search_benchmark(k, patient=None):
+    @contextmanager
+    def setup():
+        require("qdrant_client", "numpy")
+        from src.retriever import PATIENT_OVERFETCH, patient_mismatch, rank_for_patient
+
+        mismatch = patient_mismatch(patient)
+        limit = k * PATIENT_OVERFETCH if mismatch else k
+        client, query_vectors = synthetic_collection()
+        position = 0
+
+        def operation():
+            nonlocal position
+            points = client.query_points(
+                "bench",
+                query=query_vectors[position % len(query_vectors)],
+                limit=limit,
+                with_payload=True,
+            ).points
+            if mismatch:
+                rank_for_patient(
+                    [(SimpleNamespace(metadata=p.payload["metadata"]), p.score) for p in points],
+                    mismatch,
+                    k,
+                )
+            position += 1
+            return 1
+
+        yield operation
+
+    label = " re-ranked for a patient" if patient else ""
+    setup.__doc__ = f"Search of {SEARCH_POINTS} vectors, k={k}{label}."
+    return setup
+
+
+for _k in (1, 5, 10, 20):
+    benchmark(f"search.k{_k}", iterations=200, unit="queries")(_search_benchmark(_k))
+benchmark("search.k10.patient", iterations=200, unit="queries")(
+    _search_benchmark(10, patient={"age": 42, "gender": "female"})
+)
+
+
+# --- Ingestion ----------------------------------------------------------
+
+
+def _protocol_pages(cases):
+    """One tagged document per test set protocol, as rag/ingest.py loads them."""
+    from langchain_core.documents import Document
+    from tagging import protocol_tags
+
+    pages = []
+    for case in cases:
+        title = Path(case["source_file"]).stem
+        metadata = {"source_file": case["source_file"], **protocol_tags(title, case["text"])}
+        pages.append(Document(page_content=case["text"], metadata=metadata))
+    return pages
+
+
+def _chunks(cases, chunking="recursive"):
+    """Chunks of the test set with rag/ingest.py CHUNKING (default "recursive")."""
+    from chunking import chunk_documents, recursive_chunks
+
+    pages = _protocol_pages(cases)
+    if chunking == "sections":
+        return chunk_documents(pages)
+    return recursive_chunks(pages)
+
+
+def _chunk_benchmark(chunking):
+    @contextmanager
+    def setup():
+        require("langchain_text_splitters", "langchain_core")
+        _rag_imports()
+        cases = load_test_cases()
+
+        def operation():
+            _chunks(cases, chunking)
+            return len(cases)
+
+        yield operation
+
+    label = {"recursive": "recursive chunking", "sections": "section chunking"}[chunking]
+    setup.__doc__ = f"Tagging and {label} of the rag/test_set protocols (rag/ingest.py)."
+    return setup
+
+
+def _dedup_benchmark(near_duplicates):
+    @contextmanager
+    def setup():
+        require("langchain_text_splitters", "langchain_core", "numpy")
+        _rag_imports()
+        from dedup import deduplicate
+
+        chunks = _chunks(load_test_cases())
+
+        def operation():
+            deduplicate(
+                [chunk.model_copy(deep=True) for chunk in chunks], near_duplicates=near_duplicates
+            )
+            return len(chunks)
+
+        yield operation
+
+    kind = "Exact and MinHash near-duplicate" if near_duplicates else "Exact duplicate"
+    setup.__doc__ = f"{kind} detection over the test set chunks."
+    return setup
+
+
+# Default configuration of rag/ingest.py, then the opt-in paths.
+benchmark("ingest.chunk", iterations=20, unit="protocols", warmup=1)(_chunk_benchmark("recursive"))
+benchmark("ingest.chunk.sections", iterations=20, unit="protocols", warmup=1)(
+    _chunk_benchmark("sections")
+)
+benchmark("ingest.dedup", iterations=10, unit="chunks", warmup=1)(_dedup_benchmark(False))
+benchmark("ingest.dedup.near", iterations=10, unit="chunks", warmup=1)(_dedup_benchmark(True))
+
+
+@benchmark("ingest.embed", iterations=5, unit="chunks", warmup=1)
+@contextmanager
+def ingest_embed():
+    """Embedding 64 test set chunks, the bulk of ingestion time."""
+    require("langchain_text_splitters", "langchain_core")
+    _rag_imports()
+    embeddings = _embeddings()
+    texts = [chunk.page_content for chunk in _chunks(load_test_cases())[:64]]
+
+    def operation():
+        embeddings.embed_documents(texts)
+        return len(texts)
+
+    yield operation
+
+
+# --- End-to-end /diagnose -----------------------------------------------
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout_s: float = 30.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SkipBenchmark("src.mock_llm_server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SkipBenchmark("src.mock_llm_server did not start")
+
+
+@benchmark("e2e.diagnose", iterations=50, unit="requests")
+@contextmanager
+def e2e_diagnose():
+    """POST /diagnose in-process against src.mock_llm_server with zero LLM latency."""
+    require("fastapi", "httpx", "openai", "uvicorn", "langchain_qdrant")
+    from src.retriever import index_manager
+
+    spec = index_manager.target_spec()
+    if not os.path.exists(spec.qdrant_path):
+        raise SkipBenchmark(f"no index at {spec.qdrant_path} (run rag/ingest.py)")
+    _embeddings()
+
+    port = _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "src.mock_llm_server", "--port", str(port),
+         "--latency", "fixed:0", "--seed", str(SEED)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    loop = asyncio.new_event_loop()
+    client = None
+    try:
+        _wait_for_port(port, mock)
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+        import httpx
+        from src.llm_server import app
+
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60.0
+        )
+        texts = queries(load_test_cases())
+        position = 0
+
+        def operation():
+            nonlocal position
+            response = loop.run_until_complete(
+                client.post("/diagnose", json={"symptoms": texts[position % len(texts)]})
+            )
+            response.raise_for_status()
+            position += 1
+            return 1
+
+        yield operation
+    finally:
+        if client is not None:
+            loop.run_until_complete(client.aclose())
+        loop.close()
+        mock.terminate()
+        mock.wait(timeout=10)
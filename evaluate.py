@@ -3,7 +3,7 @@ import asyncio
 import json
 import statistics
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import httpx
@@ -32,6 +32,37 @@ class EvaluationResult:
     top_prediction: str
     top_3_predictions: list[str]
     response_json: dict
+    stages_ms: dict[str, float] = field(default_factory=dict)
+    llm_tokens: dict[str, int] = field(default_factory=dict)
+
+
+def parse_server_timing(header: str) -> dict[str, float]:
+    """Parse a Server-Timing header into {stage: duration_ms}."""
+    stages: dict[str, float] = {}
+    for entry in header.split(","):
+        name, *params = [p.strip() for p in entry.split(";")]
+        if not name:
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                try:
+                    stages[name] = stages.get(name, 0.0) + float(value)
+                except ValueError:
+                    pass
+    return stages
+
+
+def parse_llm_tokens(header: str) -> dict[str, int]:
+    """Parse an X-LLM-Tokens header ("prompt=123, completion=45") into {kind: tokens}."""
+    tokens: dict[str, int] = {}
+    for entry in header.split(","):
+        kind, _, value = entry.partition("=")
+        try:
+            tokens[kind.strip()] = int(value)
+        except ValueError:
+            pass
+    return tokens
 
 
 async def evaluate_single(
@@ -85,6 +116,8 @@ async def evaluate_single(
             top_prediction=top_prediction,
             top_3_predictions=top_3_predictions,
             response_json=result,
+            stages_ms=parse_server_timing(response.headers.get("server-timing", "")),
+            llm_tokens=parse_llm_tokens(response.headers.get("x-llm-tokens", "")),
         )
 
 
@@ -185,9 +218,93 @@ def compute_metrics(results: list[EvaluationResult]) -> dict:
         "latency_max_s": round(max_latency, 3),
         "latency_p50_s": round(p50_latency, 3),
         "latency_p95_s": round(p95_latency, 3),
+        **compute_stage_metrics(results),
+        **compute_token_metrics(results),
     }
 
 
+def compute_stage_metrics(results: list[EvaluationResult]) -> dict:
+    """Average and p95 per server stage, from Server-Timing headers (if any)."""
+    per_stage: dict[str, list[float]] = {}
+    for r in results:
+        for stage, duration_ms in r.stages_ms.items():
+            per_stage.setdefault(stage, []).append(duration_ms)
+    if not per_stage:
+        return {}
+
+    stages = {}
+    for stage, durations in per_stage.items():
+        if len(durations) >= 4:
+            p95 = statistics.quantiles(durations, n=20)[-1]
+        else:
+            p95 = max(durations)
+        stages[stage] = {
+            "avg_ms": round(statistics.mean(durations), 1),
+            "p95_ms": round(p95, 1),
+            "count": len(durations),
+        }
+    return {"stages": stages}
+
+
+def compute_token_metrics(results: list[EvaluationResult]) -> dict:
+    """Average LLM tokens per request, from X-LLM-Tokens headers (if any)."""
+    per_kind: dict[str, list[int]] = {}
+    for r in results:
+        for kind, tokens in r.llm_tokens.items():
+            per_kind.setdefault(kind, []).append(tokens)
+    if not per_kind:
+        return {}
+    return {
+        "llm_tokens_avg": {
+            kind: round(statistics.mean(values), 1) for kind, values in per_kind.items()
+        }
+    }
+
+
+COMPARED_METRICS = (
+    "accuracy_at_1_percent",
+    "recall_at_3_percent",
+    "latency_avg_s",
+    "latency_p50_s",
+    "latency_p95_s",
+)
+
+
+def compare_metrics(baseline: dict, metrics: dict) -> list[tuple[str, float, float]]:
+    """(metric, baseline, current) rows for metrics present in both runs."""
+    rows = [
+        (name, baseline[name], metrics[name])
+        for name in COMPARED_METRICS
+        if name in baseline and name in metrics
+    ]
+    for kind, value in metrics.get("llm_tokens_avg", {}).items():
+        if kind in baseline.get("llm_tokens_avg", {}):
+            rows.append((f"{kind}_tokens_avg", baseline["llm_tokens_avg"][kind], value))
+    for stage, s in metrics.get("stages", {}).items():
+        if stage in baseline.get("stages", {}):
+            rows.append((f"{stage}_avg_ms", baseline["stages"][stage]["avg_ms"], s["avg_ms"]))
+    return rows
+
+
+def display_comparison(baseline: dict, metrics: dict, console: Console):
+    """Print current metrics against a previous run's metrics JSON."""
+    table = Table(
+        title=f"[bold]Compared to {baseline.get('submission_name', 'baseline')}[/bold]",
+        show_header=True,
+        header_style="bold magenta",
+        border_style="cyan",
+    )
+    table.add_column("Metric", style="cyan", width=22)
+    table.add_column("Baseline", style="white", justify="right", width=12)
+    table.add_column("Current", style="green", justify="right", width=12)
+    table.add_column("Change", style="yellow", justify="right", width=10)
+    for name, before, after in compare_metrics(baseline, metrics):
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        table.add_row(name, f"{before:g}", f"{after:g}", change)
+    console.print(table)
+    console.print()
+
+
 def write_jsonl(results: list[EvaluationResult], output_path: Path):
     """Write results to JSONL file."""
     with open(output_path, "w") as f:
@@ -204,6 +321,10 @@ def write_jsonl(results: list[EvaluationResult], output_path: Path):
                     "top_3_predictions": r.top_3_predictions,
                 },
             }
+            if r.stages_ms:
+                line["stages_ms"] = {k: round(v, 1) for k, v in r.stages_ms.items()}
+            if r.llm_tokens:
+                line["llm_tokens"] = r.llm_tokens
             f.write(json.dumps(line, ensure_ascii=False) + "\n")
 
 
@@ -267,6 +388,38 @@ def display_summary(
     console.print(latency_table)
     console.print()
 
+    if metrics.get("stages"):
+        stage_table = Table(
+            title="[bold]Server Stage Breakdown[/bold]",
+            show_header=True,
+            header_style="bold magenta",
+            border_style="cyan",
+        )
+        stage_table.add_column("Stage", style="cyan", width=20)
+        stage_table.add_column("Avg (ms)", style="green", justify="right", width=12)
+        stage_table.add_column("P95 (ms)", style="green", justify="right", width=12)
+        stage_table.add_column("Count", style="green", justify="right", width=8)
+        for stage, s in metrics["stages"].items():
+            stage_table.add_row(
+                stage, f"{s['avg_ms']:.1f}", f"{s['p95_ms']:.1f}", str(s["count"])
+            )
+        console.print(stage_table)
+        console.print()
+
+    if metrics.get("llm_tokens_avg"):
+        tokens_table = Table(
+            title="[bold]LLM Tokens per Request[/bold]",
+            show_header=True,
+            header_style="bold magenta",
+            border_style="cyan",
+        )
+        tokens_table.add_column("Kind", style="cyan", width=20)
+        tokens_table.add_column("Average", style="green", justify="right", width=15)
+        for kind, value in metrics["llm_tokens_avg"].items():
+            tokens_table.add_row(kind, f"{value:.1f}")
+        console.print(tokens_table)
+        console.print()
+
     success_text = Text()
     success_text.append("✓ ", style="bold green")
     success_text.append("Results saved to:\n", style="white")
@@ -318,6 +471,11 @@ Examples:
         default=Path("data/evals"),
         help="Output directory for results (default: data/evals)",
     )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        help="Metrics JSON of a previous run to compare against (e.g. data/evals/chunks_metrics.json)",
+    )
 
     args = parser.parse_args()
     console = Console()
@@ -350,6 +508,9 @@ Examples:
         metrics = compute_metrics(results)
         write_metrics_json(args.name, metrics, output_json)
         display_summary(results, metrics, output_jsonl, output_json, console)
+        if args.compare:
+            with open(args.compare) as f:
+                display_comparison(json.load(f), metrics, console)
 
     return 0
 
@@ -0,0 +1,70 @@
+"""
+Builds the ICD-10 code index used by src/parsing.py to validate LLM answers.
+
+ingest.py calls build_code_index() with the protocol texts it has just
+loaded and writes the codes (plus their 3-character categories) to
+icd_codes.json in the new index version (or the project root with
+VERSIONED = False). The whole text is scanned, not only the
+code table (tagging.protocol_codes), which is often longer than its window.
+
+Run as a script to rebuild the index from the PDFs without re-ingesting. It
+never opens the Qdrant store: embedded Qdrant locks it to the running server.
+
+Usage:
+    uv run python build_code_index.py                        # PDFs in files/
+    uv run python build_code_index.py -d ../data/test_set    # test set JSON
+"""
+
+import argparse
+import json
+import pathlib
+import re
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+PDF_DIR = SCRIPT_DIR / "files"
+OUTPUT_PATH = SCRIPT_DIR / "../icd_codes.json"
+
+
+def extract_icd_codes(text):
+    """Extracts ICD-10 codes from a given text."""
+    return re.findall(r"\b[A-Z][0-9]{2}(?:\.[0-9]{1,2})?\b", text)
+
+
+def build_code_index(protocols):
+    """Sorted codes and their categories from {source_file: full text}."""
+    codes = set()
+    for text in protocols.values():
+        codes.update(extract_icd_codes(text))
+    codes.update({code[:3] for code in codes})
+    return sorted(codes)
+
+
+def write_code_index(codes, path=OUTPUT_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(codes, f, ensure_ascii=False, indent=0)
+        f.write("\n")
+
+
+def main():
+    from build_digests import load_json_protocols, load_pdf_protocols
+
+    parser = argparse.ArgumentParser(description="Build the ICD-10 code index")
+    parser.add_argument("--pdf-dir", type=pathlib.Path, default=PDF_DIR)
+    parser.add_argument(
+        "-d", "--dataset-dir", type=pathlib.Path, help="Read protocol texts from JSON files instead"
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    if args.dataset_dir:
+        protocols = load_json_protocols(args.dataset_dir)
+    else:
+        protocols = load_pdf_protocols(args.pdf_dir)
+    codes = build_code_index(protocols)
+    write_code_index(codes, args.output)
+    print(f"Scanned {len(protocols)} protocols, wrote {len(codes)} codes to {args.output.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
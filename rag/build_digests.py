@@ -0,0 +1,272 @@
+"""
+Builds compact per-protocol digests used by the server's digest prompt mode.
+
+ingest.py builds the digests into every index version before publishing it
+(DIGEST_METHOD there), and the server reads them from the version it is
+serving. Run this script only to rebuild ../digests.json, which the server
+uses without a manifest or for versions built without digests.
+
+For every protocol the digest keeps what the LLM needs
+to pick a diagnosis — the ICD-10 code table, the definition, the diagnostic
+criteria (complaints, anamnesis, examination) and the differential
+diagnosis — and drops everything else. The server (src/digests.py, with
+PROMPT_MODE=digest) then puts the digests of the retrieved protocols into
+the prompt instead of the raw chunks.
+
+Digests are extractive by default (section texts cut at sentence
+boundaries). With --llm each protocol is condensed by the LLM instead.
+Every digest records the SHA-256 of its protocol text: re-running the
+script only rebuilds protocols whose text changed since the last run.
+
+Usage:
+    uv run python build_digests.py                        # PDFs in files/
+    uv run python build_digests.py -d ../data/test_set    # test set JSON
+    uv run python build_digests.py --llm
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import re
+
+from tqdm import tqdm
+
+from chunking import split_sections
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+PDF_DIR = SCRIPT_DIR / "files"
+OUTPUT_PATH = SCRIPT_DIR / "../digests.json"
+LLM_MODEL = "oss-120b"
+# Bump when the digest layout changes: all digests are rebuilt.
+DIGEST_FORMAT = 1
+
+MAX_CODES = 30
+DEFINITION_CHARS = 400
+CRITERIA_CHARS = 900
+DIFFERENTIAL_CHARS = 300
+
+CODE_ROW_RE = re.compile(
+    r"\b([A-Z][0-9]{2}(?:\.[0-9]{1,2})?)\s+(.+?)(?=\s+[A-Z][0-9]{2}(?:\.[0-9]{1,2})?\s|$)",
+    re.DOTALL,
+)
+CRITERIA_HEADING_RE = re.compile(
+    r"диагностические критерии|жалобы|анамнез|физикальное", re.IGNORECASE
+)
+_HEADING_PREFIX_RE = re.compile(r"^\d{1,2}(?:\.\d{1,2}){0,2}\.?[\s:]+")
+
+LLM_PROMPT = """Сократи клинический протокол до краткой выжимки для диагностики (не более 1200 символов).
+Оставь: ключевые симптомы и жалобы, диагностические критерии, с чем дифференцировать.
+Не включай лечение, организационные разделы и литературу. Ответь только текстом выжимки.
+
+ПРОТОКОЛ: {title}
+
+{material}"""
+
+
+def content_hash(text):
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(f"{DIGEST_FORMAT}:{normalized}".encode()).hexdigest()
+
+
+def _clip(text, limit):
+    """Cuts text at the last sentence end (or space) before limit."""
+    text = re.sub(r"\s+", " ", text).strip()
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    end = max(cut.rfind(". "), cut.rfind("; "))
+    if end < limit // 2:
+        end = cut.rfind(" ")
+    return cut[: end + 1].rstrip(" ;") + " …"
+
+
+def _body(section):
+    """Section text without its numbered heading."""
+    text = _HEADING_PREFIX_RE.sub("", section.text, count=1)
+    first_line, _, rest = text.partition("\n")
+    # Headings like "Определение:" are followed by the text on the same line.
+    if ":" in first_line[:80]:
+        return first_line.split(":", 1)[1] + "\n" + rest
+    return rest or first_line
+
+
+def code_table(sections, text, window=2000):
+    """(code, name) rows of the protocol's ICD-10 table."""
+    tables = [s.text for s in sections if s.section_type == "codes"]
+    if not tables:
+        # Headings like "Код (-ы) МКБ-10" are not split off by chunking.py.
+        start = text.find("МКБ")
+        tables = [text[start : start + window]] if start != -1 else []
+    rows = {}
+    for table in tables:
+        for code, name in CODE_ROW_RE.findall(table):
+            # The last row runs into the next numbered heading.
+            name = re.split(r"\s\d{1,2}(?:\.\d{1,2})+\.?\s", name)[0]
+            name = re.sub(r"\s+", " ", name).strip(" ;,.")
+            if name and code not in rows:
+                rows[code] = name[:120]
+    return list(rows.items())[:MAX_CODES]
+
+
+def extractive_digest(title, text):
+    """Digest text and ICD code table from the protocol's sections."""
+    sections = split_sections(text)
+    codes = code_table(sections, text)
+
+    def first(kind, heading_re=None):
+        parts = [
+            _body(s)
+            for s in sections
+            if s.section_type == kind and (heading_re is None or heading_re.search(s.heading))
+        ]
+        return " ".join(parts)
+
+    definition = first("definition")
+    criteria = first("diagnostics", CRITERIA_HEADING_RE) or first("diagnostics")
+    differential = first("differential")
+
+    lines = [f"Протокол: {title}"]
+    if codes:
+        lines.append("Коды МКБ-10: " + "; ".join(f"{code} {name}" for code, name in codes))
+    if definition:
+        lines.append("Определение: " + _clip(definition, DEFINITION_CHARS))
+    if criteria:
+        lines.append("Диагностические критерии: " + _clip(criteria, CRITERIA_CHARS))
+    if differential:
+        lines.append("Дифференциальный диагноз: " + _clip(differential, DIFFERENTIAL_CHARS))
+    if len(lines) == 1 + bool(codes):
+        # No recognizable sections: fall back to the beginning of the text.
+        lines.append(_clip(text, DEFINITION_CHARS + CRITERIA_CHARS))
+    return "\n".join(lines), [code for code, _ in codes]
+
+
+def llm_digest(client, title, text):
+    """Condenses the protocol with the LLM; the code table stays extractive."""
+    sections = split_sections(text)
+    codes = code_table(sections, text)
+    material = "\n\n".join(
+        s.text for s in sections if s.section_type in ("definition", "diagnostics", "differential")
+    )
+    if not material:
+        return extractive_digest(title, text)
+    response = client.chat.completions.create(
+        model=LLM_MODEL,
+        messages=[
+            {"role": "user", "content": LLM_PROMPT.format(title=title, material=material[:12000])}
+        ],
+        timeout=120.0,
+    )
+    summary = (response.choices[0].message.content or "").strip()
+    if not summary:
+        return extractive_digest(title, text)
+    lines = [f"Протокол: {title}"]
+    if codes:
+        lines.append("Коды МКБ-10: " + "; ".join(f"{code} {name}" for code, name in codes))
+    lines.append(summary)
+    return "\n".join(lines), [code for code, _ in codes]
+
+
+def load_pdf_protocols(pdf_dir):
+    """{source_file: full text} from the PDFs ingested by ingest.py."""
+    from ingest import load_documents, protocol_texts
+
+    return protocol_texts(load_documents(str(pdf_dir)))
+
+
+def load_json_protocols(dataset_dir):
+    """{source_file: full text} from test set JSON files."""
+    protocols = {}
+    for path in sorted(pathlib.Path(dataset_dir).glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            case = json.load(f)
+        protocols.setdefault(case["source_file"], case["text"])
+    return protocols
+
+
+def load_existing(path):
+    if path is None or not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("protocols", {}) if data.get("format") == DIGEST_FORMAT else {}
+
+
+def llm_client():
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
+    load_dotenv(SCRIPT_DIR / "../.env")
+    return OpenAI(
+        base_url=os.getenv("OPENAI_BASE_URL", "https://hub.qazcode.ai"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+    )
+
+
+def build_digests(protocols, existing, client=None):
+    """Returns ({source_file: digest entry}, rebuilt count); unchanged digests are reused."""
+    method = "llm" if client is not None else "extractive"
+    digests = {}
+    rebuilt = 0
+    for source_file, text in tqdm(sorted(protocols.items()), desc="Building digests"):
+        digest_hash = content_hash(text)
+        previous = existing.get(source_file)
+        if previous and previous["content_hash"] == digest_hash and previous["method"] == method:
+            digests[source_file] = previous
+            continue
+        title = os.path.splitext(source_file)[0]
+        if client is not None:
+            digest, codes = llm_digest(client, title, text)
+        else:
+            digest, codes = extractive_digest(title, text)
+        digests[source_file] = {
+            "content_hash": digest_hash,
+            "method": method,
+            "codes": codes,
+            "digest": digest,
+        }
+        rebuilt += 1
+    return digests, rebuilt
+
+
+def write_digests(digests, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"format": DIGEST_FORMAT, "protocols": digests}, f, ensure_ascii=False, indent=1
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build per-protocol digests")
+    parser.add_argument("--pdf-dir", type=pathlib.Path, default=PDF_DIR)
+    parser.add_argument(
+        "-d", "--dataset-dir", type=pathlib.Path, help="Read protocol texts from JSON files instead"
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, default=OUTPUT_PATH)
+    parser.add_argument("--llm", action="store_true", help="Condense protocols with the LLM")
+    args = parser.parse_args()
+
+    if args.dataset_dir:
+        protocols = load_json_protocols(args.dataset_dir)
+    else:
+        protocols = load_pdf_protocols(args.pdf_dir)
+    if not protocols:
+        print("No protocols loaded.")
+        return
+
+    client = llm_client() if args.llm else None
+    digests, rebuilt = build_digests(protocols, load_existing(args.output), client)
+    write_digests(digests, args.output)
+
+    raw_chars = sum(len(text) for text in protocols.values())
+    digest_chars = sum(len(d["digest"]) for d in digests.values())
+    print(f"Protocols: {len(digests)} ({rebuilt} rebuilt, {len(digests) - rebuilt} unchanged)")
+    print(f"Average protocol text: {raw_chars / len(digests):.0f} chars")
+    print(f"Average digest:        {digest_chars / len(digests):.0f} chars")
+    print(f"Wrote digests to {args.output.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Section-aware chunking for Kazakh clinical protocols.
+
+Protocols follow a fixed numbered structure ("1. ВВОДНАЯ ЧАСТЬ", "1.1 Код(ы)
+МКБ-10", "2.1 Диагностические критерии", "3. ОРГАНИЗАЦИОННЫЕ АСПЕКТЫ", ...).
+Instead of cutting raw pages into overlapping 1000-character windows, the
+protocol text is split on these numbered headings, every chunk is tagged
+with its section type, and short administrative boilerplate (the approval
+header, abbreviations, developers, reviewers, references, ...) is dropped.
+Headings are numbered "2.", "2.1" or "1)"; a boilerplate section longer than
+BOILERPLATE_MAX_CHARS is kept, since it has usually swallowed clinical text
+whose heading was not recognized. A protocol that would lose every chunk
+falls back to plain recursive splitting.
+
+Sections longer than chunk_size are split further without overlap; short
+neighbouring sections of the same type are merged. Each chunk starts with
+the protocol title, which the dropped header used to carry.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Section types whose chunks are not embedded unless keep_boilerplate=True.
+BOILERPLATE_TYPES = {"header", "admin", "references"}
+# Longer boilerplate sections are embedded anyway (see the module docstring).
+BOILERPLATE_MAX_CHARS = 5000
+
+# (heading keyword regex, section type); checked in order, first match wins.
+SECTION_KEYWORDS = [
+    (r"код\s*\(\s*-?\s*ы\s*\)|коды мкб|соотношение кодов мкб|код протокола", "codes"),
+    (r"вводная часть|название протокола", "admin"),
+    (r"дата разработки|сокращения, используемые|пользователи протокола"
+     r"|категория пациентов|шкала уровня доказательности|организационные аспекты"
+     r"|список разработчиков|указание на отсутствие конфликта|рецензент"
+     r"|указание условий пересмотра|содержание", "admin"),
+    (r"список использованной литературы", "references"),
+    (r"определение", "definition"),
+    (r"клиническая классификация|классификация", "classification"),
+    (r"дифференциальный диагноз", "differential"),
+    (r"методы, подходы и процедуры|диагностические критерии|диагностический алгоритм"
+     r"|жалобы|анамнез|физикальное обследование|лабораторные исследования"
+     r"|инструментальные исследования|перечень основных и дополнительных"
+     r"|основные \(обязательные\) диагностические|дополнительные диагностические"
+     r"|минимальный перечень обследования|диагностика и лечение на"
+     r"|диагностические мероприятия|показания для консультации", "diagnostics"),
+    (r"тактика лечения|немедикаментозное лечение|медикаментозное лечение"
+     r"|хирургическое вмешательство|другие виды лечения|дальнейшее ведение"
+     r"|показания для (?:плановой |экстренной )?госпитализации|профилактические мероприятия"
+     r"|цель проведения процедуры|показания к процедуре|противопоказания к процедуре"
+     r"|показания и противопоказания|требования к проведению процедуры", "treatment"),
+    (r"методы и процедуры|цель реабилитации|тактика реабилитации|этапы и объемы реабилитации"
+     r"|объемы медицинской реабилитации|основные методы реабилитации|дополнительные методы"
+     r"|основные мероприятия|дополнительные мероприятия"
+     r"|(?:показания|противопоказания) (?:для|к) (?:медицинской )?реабилитации"
+     r"|продолжительность|критерии для определения", "rehabilitation"),
+    (r"индикаторы эффективности", "outcomes"),
+]
+
+_KEYWORD_RE = "|".join(f"(?:{pattern})" for pattern, _ in SECTION_KEYWORDS)
+HEADING_RE = re.compile(
+    rf"(?<![\d.,\w-])(\d{{1,2}}(?:\.\d{{1,2}}){{0,2}})[.)]?[\s:]+(?=(?:{_KEYWORD_RE}))",
+    re.IGNORECASE,
+)
+_TYPE_RES = [(re.compile(pattern, re.IGNORECASE), kind) for pattern, kind in SECTION_KEYWORDS]
+
+
+@dataclass
+class Section:
+    section_type: str
+    heading: str
+    text: str
+
+
+def _section_type(heading_text):
+    for pattern, kind in _TYPE_RES:
+        if pattern.match(heading_text):
+            return kind
+    return "other"
+
+
+def split_sections(text):
+    """Splits protocol text on numbered headings; text before the first one is the header."""
+    matches = list(HEADING_RE.finditer(text))
+    sections = []
+    if not matches or matches[0].start() > 0:
+        end = matches[0].start() if matches else len(text)
+        sections.append(Section("header", "", text[:end].strip()))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[match.end() : end]
+        sections.append(
+            Section(
+                _section_type(body),
+                f"{match.group(1)} {body[:60].strip()}",
+                text[match.start() : end].strip(),
+            )
+        )
+    return [s for s in sections if s.text]
+
+
+def _merge_small(sections, chunk_size, min_size):
+    merged = []
+    for section in sections:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and previous.section_type == section.section_type
+            and (len(previous.text) < min_size or len(section.text) < min_size)
+            and len(previous.text) + len(section.text) + 1 <= chunk_size
+        ):
+            previous.text = f"{previous.text}\n{section.text}"
+        else:
+            merged.append(Section(section.section_type, section.heading, section.text))
+    return merged
+
+
+def chunk_protocol(
+    text, metadata, title="", chunk_size=1000, min_size=200, keep_boilerplate=False
+):
+    """Chunks one protocol's full text into Documents with section metadata."""
+    prefix = f"{title}\n" if title else ""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size - len(prefix), chunk_overlap=0, length_function=len
+    )
+    sections = _merge_small(split_sections(text), chunk_size, min_size)
+    if not any(s.section_type not in BOILERPLATE_TYPES for s in sections):
+        # No clinical section recognized: keep the whole protocol rather than nothing.
+        sections = [Section("other", "", text)]
+    elif not keep_boilerplate:
+        sections = [
+            s
+            for s in sections
+            if s.section_type not in BOILERPLATE_TYPES or len(s.text) > BOILERPLATE_MAX_CHARS
+        ]
+    chunks = []
+    for section in sections:
+        for piece in splitter.split_text(section.text):
+            chunks.append(
+                Document(
+                    page_content=prefix + piece,
+                    metadata={
+                        **metadata,
+                        "section_type": section.section_type,
+                        "section": section.heading,
+                    },
+                )
+            )
+    return chunks
+
+
+def recursive_chunks(pages, chunk_size=1000, chunk_overlap=200):
+    """The default chunking (ingest.py CHUNKING="recursive"): overlapping windows over each page."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+    return splitter.split_documents(pages)
+
+
+def chunk_documents(pages, chunk_size=1000, keep_boilerplate=False):
+    """Groups loaded PDF pages by source_file and chunks each protocol as a whole."""
+    protocols = {}
+    for page in pages:
+        protocols.setdefault(page.metadata["source_file"], []).append(page)
+
+    chunks = []
+    for source_file, protocol_pages in protocols.items():
+        text = "\n".join(page.page_content for page in protocol_pages)
+        metadata = {
+            k: v for k, v in protocol_pages[0].metadata.items() if k not in ("page", "page_label")
+        }
+        chunks.extend(
+            chunk_protocol(
+                text,
+                metadata,
+                title=os.path.splitext(source_file)[0],
+                chunk_size=chunk_size,
+                keep_boilerplate=keep_boilerplate,
+            )
+        )
+    return chunks
@@ -0,0 +1,173 @@
+"""
+Compares the old recursive chunking with section-aware chunking (chunking.py),
+with and without deduplication (dedup.py).
+
+Runs offline on the protocol texts in the test set JSON files and reports,
+per strategy: chunk count, stored characters, estimated index size and
+chunking time. With --embed it also embeds every variant into in-memory
+Qdrant collections and reports ingestion time and document recall@1/3/5
+for the test queries.
+
+Usage:
+    uv run python chunking_report.py
+    uv run python chunking_report.py --embed
+"""
+
+import argparse
+import json
+import pathlib
+import time
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rich.console import Console
+from rich.table import Table
+
+from chunking import chunk_protocol
+from dedup import deduplicate
+from tagging import protocol_tags
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+TEST_SET_DIR = SCRIPT_DIR / "../data/test_set"
+EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+EMBEDDING_DIM = 1024
+OUTPUT_PATH = SCRIPT_DIR / "chunking_report.json"
+
+
+def load_protocols(dataset_dir):
+    """Returns test cases with their protocol text, one per JSON file."""
+    cases = []
+    for path in sorted(pathlib.Path(dataset_dir).glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            cases.append(json.load(f))
+    return cases
+
+
+def recursive_chunks(cases):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=200, length_function=len
+    )
+    docs = [
+        Document(page_content=case["text"], metadata={"source_file": case["source_file"]})
+        for case in cases
+    ]
+    return splitter.split_documents(docs)
+
+
+def section_chunks(cases):
+    chunks = []
+    for case in cases:
+        title = pathlib.Path(case["source_file"]).stem
+        metadata = {"source_file": case["source_file"], **protocol_tags(title, case["text"])}
+        chunks.extend(chunk_protocol(case["text"], metadata, title=title))
+    return chunks
+
+
+def section_dedup_chunks(cases):
+    return deduplicate(section_chunks(cases))[0]
+
+
+STRATEGIES = {
+    "recursive": recursive_chunks,
+    "sections": section_chunks,
+    "sections+dedup": section_dedup_chunks,
+}
+
+
+def size_stats(chunks):
+    text_bytes = sum(len(c.page_content.encode("utf-8")) for c in chunks)
+    return {
+        "chunks": len(chunks),
+        "stored_chars": sum(len(c.page_content) for c in chunks),
+        "avg_chunk_chars": round(
+            sum(len(c.page_content) for c in chunks) / max(1, len(chunks)), 1
+        ),
+        "est_index_mb": round((len(chunks) * EMBEDDING_DIM * 4 + text_bytes) / 2**20, 2),
+    }
+
+
+def embed_and_evaluate(chunks, cases, embeddings, name):
+    """Embeds chunks into an in-memory collection and measures document recall."""
+    from langchain_qdrant import QdrantVectorStore
+
+    start = time.perf_counter()
+    vectorstore = QdrantVectorStore.from_documents(
+        documents=chunks,
+        embedding=embeddings,
+        location=":memory:",
+        collection_name=f"chunking-report-{name.replace('+', '-')}",
+    )
+    ingest_s = time.perf_counter() - start
+
+    hits = {1: 0, 3: 0, 5: 0}
+    evaluated = 0
+    for case in cases:
+        query = (case.get("query") or "").strip()
+        if not query:
+            continue
+        evaluated += 1
+        docs = vectorstore.similarity_search(query, k=5)
+        # A deduplicated chunk takes one rank position, whatever its owner count.
+        owners = [d.metadata.get("source_files") or [d.metadata.get("source_file")] for d in docs]
+        for k in hits:
+            if any(case["source_file"] in chunk for chunk in owners[:k]):
+                hits[k] += 1
+    total = max(1, evaluated)
+    return {
+        "ingest_s": round(ingest_s, 2),
+        **{f"recall_at_{k}_percent": round(v / total * 100, 2) for k, v in hits.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunking strategies")
+    parser.add_argument("-d", "--dataset-dir", type=pathlib.Path, default=TEST_SET_DIR)
+    parser.add_argument(
+        "--embed",
+        action="store_true",
+        help="Also embed all variants and measure ingestion time and recall",
+    )
+    args = parser.parse_args()
+    console = Console()
+
+    cases = load_protocols(args.dataset_dir)
+    console.print(f"Loaded {len(cases)} protocols from {args.dataset_dir}")
+    raw_chars = sum(len(c["text"]) for c in cases)
+
+    embeddings = None
+    if args.embed:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        console.print(f"Loading embedding model: [yellow]{EMBEDDING_MODEL}[/yellow]...")
+        embeddings = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL, model_kwargs={"device": "cpu"}
+        )
+
+    report = {"protocols": len(cases), "raw_chars": raw_chars, "strategies": {}}
+    for name, strategy in STRATEGIES.items():
+        start = time.perf_counter()
+        chunks = strategy(cases)
+        stats = {"chunking_s": round(time.perf_counter() - start, 3), **size_stats(chunks)}
+        stats["stored_vs_raw_percent"] = round(stats["stored_chars"] / raw_chars * 100, 1)
+        if embeddings is not None:
+            console.print(f"Embedding [cyan]{name}[/cyan] ({len(chunks)} chunks)...")
+            stats.update(embed_and_evaluate(chunks, cases, embeddings, name))
+        report["strategies"][name] = stats
+
+    table = Table(title="[bold]Chunking: before vs after[/bold]")
+    table.add_column("Metric", style="cyan")
+    for name in STRATEGIES:
+        table.add_column(name, style="magenta", justify="right")
+    for metric in report["strategies"]["recursive"]:
+        table.add_row(metric, *(str(report["strategies"][n].get(metric, "")) for n in STRATEGIES))
+    console.print(table)
+
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    console.print(f"\n[bold green]✓ Report saved to {OUTPUT_PATH}[/bold green]")
+
+
+if __name__ == "__main__":
+    main()
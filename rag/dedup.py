@@ -0,0 +1,157 @@
+"""
+Exact and near-duplicate detection across protocol chunks.
+
+Many protocols share passages verbatim or almost verbatim (diagnostic
+criteria, drug tables, legal text). deduplicate() keeps one chunk per
+group of duplicates and records every owning protocol in
+metadata["source_files"]; at retrieval time src/retriever.py attributes
+each such chunk to its best-ranked owner.
+
+Exact duplicates are found by hashing normalized text. Near duplicates
+(near_duplicates=True, off by default) are found by MinHash over word
+shingles with LSH banding, confirmed by the estimated Jaccard similarity.
+Near duplicates often differ only in a dose, stage or duration, and the
+kept text stands in for every owner's passage, so they are merged only if
+all their numbers are the same.
+"""
+
+import hashlib
+import os
+import re
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16  # 16 bands x 8 rows: candidates from ~0.7 Jaccard
+SHINGLE_SIZE = 5
+NEAR_DUP_THRESHOLD = 0.85
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def _body(doc):
+    """Chunk text without the protocol-title prefix added by chunking.py."""
+    title = os.path.splitext(doc.metadata.get("source_file", ""))[0]
+    text = doc.page_content
+    if title and text.startswith(title + "\n"):
+        return text[len(title) + 1 :]
+    return text
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
+def numbers(text):
+    """Numeric tokens in order; near duplicates are merged only if these are equal."""
+    return NUMBER_RE.findall(text)
+
+
+def minhash(text):
+    words = text.split()
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _merge_owners(docs):
+    """Metadata for the kept chunk: all owners; tags widened if owners disagree."""
+    representative = docs[0]
+    metadata = dict(representative.metadata)
+    owners = sorted({d.metadata["source_file"] for d in docs})
+    metadata["source_files"] = owners
+    for field in ("age_group", "sex"):
+        values = {d.metadata.get(field) for d in docs}
+        if len(values) > 1:
+            metadata[field] = "all"
+    if any("icd_chapters" in d.metadata for d in docs):
+        metadata["icd_chapters"] = sorted(
+            {c for d in docs for c in d.metadata.get("icd_chapters", [])}
+        )
+    return metadata
+
+
+def deduplicate(chunks, near_duplicates=False, threshold=NEAR_DUP_THRESHOLD):
+    """Returns (unique chunks, stats). The first chunk of every duplicate group is kept.
+
+    Only exact duplicates are merged unless near_duplicates is set.
+    """
+    bodies = [normalize(_body(doc)) for doc in chunks]
+    parent = list(range(len(chunks)))
+
+    exact_dups = 0
+    by_hash = {}
+    for i, body in enumerate(bodies):
+        digest = hashlib.sha1(body.encode()).hexdigest()
+        if digest in by_hash:
+            parent[i] = by_hash[digest]
+            exact_dups += 1
+        else:
+            by_hash[digest] = i
+
+    representatives = sorted(set(by_hash.values())) if near_duplicates else []
+    signatures = {i: minhash(bodies[i]) for i in representatives}
+    numeric = {i: numbers(bodies[i]) for i in representatives}
+    rows = NUM_PERM // BANDS
+    buckets = {}
+    near_dups = 0
+    for i in representatives:
+        signature = signatures[i]
+        for band in range(BANDS):
+            key = (band, signature[band * rows : (band + 1) * rows].tobytes())
+            for j in buckets.get(key, ()):
+                root_i, root_j = _find(parent, i), _find(parent, j)
+                if root_i == root_j:
+                    continue
+                if numeric[i] != numeric[j]:
+                    continue
+                if np.mean(signatures[j] == signature) >= threshold:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+                    near_dups += 1
+            buckets.setdefault(key, []).append(i)
+
+    groups = {}
+    for i in range(len(chunks)):
+        groups.setdefault(_find(parent, i), []).append(i)
+
+    unique = []
+    for root in sorted(groups):
+        members = [chunks[i] for i in groups[root]]
+        kept = members[0]
+        kept.metadata = _merge_owners(members)
+        unique.append(kept)
+
+    stored_before = sum(len(c.page_content) for c in chunks)
+    stored_after = sum(len(c.page_content) for c in unique)
+    stats = {
+        "chunks_before": len(chunks),
+        "chunks_after": len(unique),
+        "exact_duplicates": exact_dups,
+        "near_duplicates": near_dups,
+        "duplicate_rate_percent": round(
+            (len(chunks) - len(unique)) / max(1, len(chunks)) * 100, 2
+        ),
+        "shared_chunks": sum(1 for c in unique if len(c.metadata["source_files"]) > 1),
+        "stored_chars_before": stored_before,
+        "stored_chars_after": stored_after,
+    }
+    return unique, stats
@@ -2,27 +2,78 @@ import os
 import json
 import re
 import pathlib
+import sys
 from langchain_qdrant import QdrantVectorStore
 from langchain_huggingface import HuggingFaceEmbeddings
 from qdrant_client import QdrantClient
 from rich.console import Console
 from rich.table import Table
 
+from versions import current_index
+
 # Configuration
 SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
 QDRANT_PATH = str(SCRIPT_DIR / "../qdrant_db")
 COLLECTION_NAME = "protocols-multilingual-e5-large"
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
 TEST_SET_DIR = str(SCRIPT_DIR / "test_set")
+TOP_K = 5
+
+# Patient re-ranking is the server's (src/retriever.py).
+sys.path.insert(0, str(SCRIPT_DIR.parent))
+from src.retriever import PATIENT_OVERFETCH, patient_mismatch, rank_for_patient  # noqa: E402
+
+AGE_RE = re.compile(r"\b(\d{1,3})[\s-]*(?:год|года|лет|летн)", re.IGNORECASE)
+FEMALE_RE = re.compile(r"\b(?:женщина|девочка|девушка|беременна)", re.IGNORECASE)
+MALE_RE = re.compile(r"\b(?:мужчина|мальчик|юноша)", re.IGNORECASE)
 
 
-def get_retriever(embeddings, qdrant_path, collection_name):
-    """Initializes and returns a Qdrant retriever."""
+def get_vectorstore(embeddings, qdrant_path, collection_name):
+    """Initializes and returns the Qdrant vector store."""
     client = QdrantClient(path=qdrant_path)
-    qdrant = QdrantVectorStore(
+    return QdrantVectorStore(
         client=client, collection_name=collection_name, embedding=embeddings
     )
-    return qdrant.as_retriever(search_kwargs={"k": 5})
+
+
+def query_patient(query):
+    """Age and sex stated in a test query, shaped like the server's patient dict."""
+    patient = {}
+    age = AGE_RE.search(query)
+    if age:
+        patient["age"] = int(age.group(1))
+    female, male = FEMALE_RE.search(query), MALE_RE.search(query)
+    if female and not male:
+        patient["gender"] = "female"
+    elif male and not female:
+        patient["gender"] = "male"
+    return patient or None
+
+
+def chunk_owners(docs):
+    """Normalized owning filenames, one list per chunk.
+
+    Deduplicated chunks list every owning protocol in "source_files" but
+    still take a single rank position.
+    """
+    return [
+        [
+            normalize(source_file)
+            for source_file in (
+                doc.metadata.get("source_files")
+                or [doc.metadata.get("source_file", "Unknown")]
+            )
+        ]
+        for doc in docs
+    ]
+
+
+def in_top(ground_truth_file, owners, k):
+    return any(ground_truth_file in chunk for chunk in owners[:k])
+
+
+def chunk_label(owners):
+    return owners[0] if len(owners) == 1 else f"{owners[0]} (+{len(owners) - 1} more)"
 
 
 def extract_icd_codes(text):
@@ -48,7 +99,9 @@ def main():
     embeddings = HuggingFaceEmbeddings(
         model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs
     )
-    retriever = get_retriever(embeddings, QDRANT_PATH, COLLECTION_NAME)
+    # The current version from ../indexes/manifest.json, else the fixed path.
+    qdrant_path, collection_name = current_index() or (QDRANT_PATH, COLLECTION_NAME)
+    vectorstore = get_vectorstore(embeddings, qdrant_path, collection_name)
     console.print("✅ Retriever initialized.")
 
     # 2. Load test dataset
@@ -70,6 +123,11 @@ def main():
     gt_in_codes_hits = 0
     all_results = []
     evaluated = 0
+    # Queries stating an age or sex: recall without and with patient re-ranking.
+    patient_queries = 0
+    patient_hits = {
+        mode: {k: 0 for k in (1, 3, 5)} for mode in ("unfiltered", "patient_reranked")
+    }
 
     # 3. Iterate through test files
     for filename in test_files:
@@ -89,17 +147,33 @@ def main():
         ground_truth_codes = set(test_case["icd_codes"])
         ground_truth_gt = test_case["gt"]
 
-        # 4. Retrieve documents
-        retrieved_docs = retriever.invoke(query)
+        # 4. Retrieve documents; extra candidates for patient re-ranking
+        candidates = vectorstore.similarity_search_with_score(
+            query, k=TOP_K * PATIENT_OVERFETCH
+        )
+        retrieved_docs = [doc for doc, _ in candidates[:TOP_K]]
 
         # Normalize retrieved filenames for reliable comparison
-        retrieved_files = [
-            normalize(doc.metadata.get("source_file", "Unknown"))
-            for doc in retrieved_docs
-        ]
+        retrieved_owners = chunk_owners(retrieved_docs)
+        retrieved_files = [chunk_label(owners) for owners in retrieved_owners]
+
+        patient = query_patient(query)
+        mismatch = patient_mismatch(patient)
+        reranked_files = None
+        if mismatch:
+            patient_queries += 1
+            reranked_owners = chunk_owners(rank_for_patient(candidates, mismatch, TOP_K))
+            reranked_files = [chunk_label(owners) for owners in reranked_owners]
+            for mode, owners in (
+                ("unfiltered", retrieved_owners),
+                ("patient_reranked", reranked_owners),
+            ):
+                for k in patient_hits[mode]:
+                    if in_top(ground_truth_file, owners, k):
+                        patient_hits[mode][k] += 1
 
         # Debug: show repr if top-1 looks like a match but isn't
-        if retrieved_files and retrieved_files[0] != ground_truth_file:
+        if retrieved_owners and ground_truth_file not in retrieved_owners[0]:
             raw_gt = test_case["source_file"]
             raw_ret = retrieved_docs[0].metadata.get("source_file", "Unknown")
             if raw_gt.strip() == raw_ret.strip():
@@ -114,9 +188,9 @@ def main():
         retrieved_top_3 = retrieved_files[:3]
         retrieved_top_5 = retrieved_files[:5]
 
-        is_in_top_1 = ground_truth_file == retrieved_top_1
-        is_in_top_3 = ground_truth_file in retrieved_top_3
-        is_in_top_5 = ground_truth_file in retrieved_top_5
+        is_in_top_1 = in_top(ground_truth_file, retrieved_owners, 1)
+        is_in_top_3 = in_top(ground_truth_file, retrieved_owners, 3)
+        is_in_top_5 = in_top(ground_truth_file, retrieved_owners, 5)
 
         if is_in_top_1:
             recall_at_1 += 1
@@ -172,6 +246,8 @@ def main():
                 "query": query,
                 "ground_truth_file": ground_truth_file,
                 "retrieved_files": retrieved_files,
+                "patient": patient,
+                "patient_reranked_files": reranked_files,
                 "is_in_top_1": is_in_top_1,
                 "is_in_top_3": is_in_top_3,
                 "is_in_top_5": is_in_top_5,
@@ -200,6 +276,12 @@ def main():
         "document_recall_at_5_percent": recall_at_5_percent,
         "code_recall_percent": code_recall_percent,
         "gt_in_extracted_codes_percent": gt_in_codes_percent,
+        "patient_test_cases": patient_queries,
+        **{
+            f"{mode}_recall_at_{k}_percent": (hits / max(1, patient_queries)) * 100
+            for mode, by_k in patient_hits.items()
+            for k, hits in by_k.items()
+        },
     }
 
     metrics_table = Table(title="[bold]Overall Retrieval Metrics[/bold]")
@@ -216,6 +298,20 @@ def main():
 
     console.print(metrics_table)
 
+    patient_table = Table(
+        title=f"[bold]Patient Re-ranking ({patient_queries} queries with age or sex)[/bold]"
+    )
+    patient_table.add_column("Metric", style="cyan")
+    patient_table.add_column("Unfiltered", style="bold green")
+    patient_table.add_column("Re-ranked", style="bold green")
+    for k in (1, 3, 5):
+        patient_table.add_row(
+            f"Document Recall@{k}",
+            f"{summary_metrics[f'unfiltered_recall_at_{k}_percent']:.2f}%",
+            f"{summary_metrics[f'patient_reranked_recall_at_{k}_percent']:.2f}%",
+        )
+    console.print(patient_table)
+
     # 8. Save results
     output_path = SCRIPT_DIR / "retriever_evaluation_results.json"
     output_data = {"summary_metrics": summary_metrics, "results": all_results}
@@ -3,14 +3,49 @@ import glob
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_qdrant import QdrantVectorStore
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client import models
 from tqdm import tqdm
 
+import build_code_index
+import build_digests
+from chunking import chunk_documents, recursive_chunks
+from dedup import deduplicate
+from tagging import protocol_tags
+from versions import (
+    INDEX_DIR,
+    artifact_path,
+    current_artifact,
+    new_version,
+    publish_version,
+    version_path,
+)
+
 # Configuration
 PDF_DIR = "files"
 QDRANT_PATH = "../qdrant_db"
 COLLECTION_NAME = "protocols-multilingual-e5-large"
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+# "sections": split on numbered protocol sections and drop boilerplate
+# (see chunking.py); "recursive": the previous 1000/200 character windows.
+# Stays "recursive" until chunking_report.py --embed shows no recall loss
+# for "sections" (rag/chunking_report.json has no recall figures yet).
+CHUNKING = "recursive"
+KEEP_BOILERPLATE = False
+# Store passages shared by several protocols once (see dedup.py).
+DEDUP = True
+# Also merge near duplicates with the same numbers (MinHash); off because
+# the kept text stands in for every owner's passage.
+NEAR_DUPLICATES = False
+# Build a new index version next to the one the server is using and publish
+# it in ../indexes/manifest.json (see versions.py); the server switches to it
+# without a restart. False: write QDRANT_PATH in place as before.
+VERSIONED = True
+# Protocol digests for PROMPT_MODE=digest, built with the index (see
+# build_digests.py): "extractive", "llm" or None to skip.
+DIGEST_METHOD = "extractive"
+# Keep only the newest N index versions on disk after publishing; versions a
+# running server still has open are never deleted. None: keep every version.
+KEEP_VERSIONS = None
 
 def load_documents(pdf_dir):
     documents = []
@@ -31,15 +66,28 @@ def load_documents(pdf_dir):
         try:
             loader = PyPDFLoader(pdf_path)
             docs = loader.load()
-            # Add source filename to metadata
+            # Add source filename and patient applicability tags to metadata
+            source_file = os.path.basename(pdf_path)
+            tags = protocol_tags(
+                os.path.splitext(source_file)[0],
+                " ".join(doc.page_content for doc in docs),
+            )
             for doc in docs:
-                 doc.metadata["source_file"] = os.path.basename(pdf_path)
+                 doc.metadata["source_file"] = source_file
+                 doc.metadata.update(tags)
             documents.extend(docs)
         except Exception as e:
             print(f"Error loading {pdf_path}: {e}")
             
     return documents
 
+def protocol_texts(docs):
+    """{source_file: full text} from the loaded pages."""
+    protocols = {}
+    for page in docs:
+        protocols.setdefault(page.metadata["source_file"], []).append(page.page_content)
+    return {source_file: "\n".join(pages) for source_file, pages in protocols.items()}
+
 def main():
     print(f"Loading documents from {PDF_DIR}...")
     docs = load_documents(PDF_DIR)
@@ -48,27 +96,87 @@ def main():
         return
     print(f"Loaded {len(docs)} document pages.")
 
-    print("Splitting documents...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    splits = text_splitter.split_documents(docs)
+    # Digests and the code index are built from the texts at hand (the Qdrant
+    # store is locked by a running server) and published with the version,
+    # so the server never pairs a new index with stale files.
+    protocols = protocol_texts(docs)
+    artifacts = {}
+    if VERSIONED:
+        version = new_version()
+        code_index_path = artifact_path(version, "icd_codes.json")
+        digests_path = artifact_path(version, "digests.json")
+        artifacts["code_index"] = f"{version}/icd_codes.json"
+        previous_digests = current_artifact("digests")
+    else:
+        code_index_path = build_code_index.OUTPUT_PATH
+        digests_path = build_digests.OUTPUT_PATH
+        previous_digests = digests_path
+
+    codes = build_code_index.build_code_index(protocols)
+    build_code_index.write_code_index(codes, code_index_path)
+    print(f"Wrote {len(codes)} ICD-10 codes to {code_index_path}")
+
+    if DIGEST_METHOD:
+        client = build_digests.llm_client() if DIGEST_METHOD == "llm" else None
+        digests, rebuilt = build_digests.build_digests(
+            protocols, build_digests.load_existing(previous_digests), client
+        )
+        build_digests.write_digests(digests, digests_path)
+        if VERSIONED:
+            artifacts["digests"] = f"{version}/digests.json"
+        print(f"Wrote {len(digests)} digests ({rebuilt} rebuilt) to {digests_path}")
+
+    print(f"Splitting documents ({CHUNKING})...")
+    if CHUNKING == "sections":
+        splits = chunk_documents(docs, keep_boilerplate=KEEP_BOILERPLATE)
+    else:
+        splits = recursive_chunks(docs)
     print(f"Created {len(splits)} chunks.")
 
+    if DEDUP:
+        print("Removing duplicate chunks...")
+        splits, dedup_stats = deduplicate(splits, near_duplicates=NEAR_DUPLICATES)
+        for key, value in dedup_stats.items():
+            print(f"  {key}: {value}")
+
     print(f"Initializing embeddings ({EMBEDDING_MODEL})...")
     embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
 
-    print(f"Creating/Updating Qdrant vector store at {QDRANT_PATH}...")
+    qdrant_path = QDRANT_PATH
+    if VERSIONED:
+        qdrant_path = str(version_path(version))
+    print(f"Creating/Updating Qdrant vector store at {qdrant_path}...")
     
-    QdrantVectorStore.from_documents(
+    vectorstore = QdrantVectorStore.from_documents(
         documents=splits,
         embedding=embeddings,
-        path=QDRANT_PATH,
+        path=qdrant_path,
         collection_name=COLLECTION_NAME,
         force_recreate=False
     )
+
+    # Used by a Qdrant server; local mode (path=...) ignores payload indexes
+    # and filters by scanning payloads.
+    print("Creating payload indexes on patient tags...")
+    for field_name in (
+        "metadata.age_group",
+        "metadata.sex",
+        "metadata.icd_chapters",
+        "metadata.section_type",
+    ):
+        vectorstore.client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+
+    if VERSIONED:
+        # Release the local storage lock before the server opens this version.
+        vectorstore.client.close()
+        publish_version(
+            version, COLLECTION_NAME, keep=KEEP_VERSIONS, chunks=len(splits), **artifacts
+        )
+        print(f"Published index version {version} in {INDEX_DIR.resolve()}/manifest.json")
     
     print("Ingestion complete.")
 
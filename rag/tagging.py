@@ -0,0 +1,132 @@
+"""
+Protocol-level payload tags used to filter retrieval by patient.
+
+Every chunk of a protocol gets the same tags in its metadata:
+    age_group    — "pediatric", "adult" or "all"
+    sex          — "female", "male" or "all"
+    icd_chapters — ICD-10 chapters (roman numerals) of the protocol's codes
+
+With PATIENT_FILTERS=1 the server (src/retriever.py) ranks chunks whose
+age_group/sex do not match the patient lower; no chunk is excluded, since a
+protocol for one age group often also covers the other.
+"""
+
+import re
+
+ICD_CODE_RE = re.compile(r"\b([A-Z])([0-9]{2})(?:\.[0-9]{1,2})?\b")
+
+PEDIATRIC_MARKERS = ("у детей", "детей", "детск", "новорожденн", "недоношенн", "подростк")
+ADULT_MARKERS = ("у взрослых", "взрослых")
+FEMALE_MARKERS = ("беременн", "родоразреш", "послеродов", "гинеколог", "матк", "яичник", "вульв")
+MALE_MARKERS = ("предстательн", "простат", "яичк", "мошонк", "гипоспади")
+PATIENT_CATEGORY_RE = re.compile(r"категори[яи] пациентов[:\s]*(.{0,200})", re.IGNORECASE | re.DOTALL)
+
+# (first letter, first number, last letter, last number, chapter)
+ICD_CHAPTERS = [
+    ("A", 0, "B", 99, "I"),
+    ("C", 0, "D", 48, "II"),
+    ("D", 50, "D", 89, "III"),
+    ("E", 0, "E", 90, "IV"),
+    ("F", 0, "F", 99, "V"),
+    ("G", 0, "G", 99, "VI"),
+    ("H", 0, "H", 59, "VII"),
+    ("H", 60, "H", 95, "VIII"),
+    ("I", 0, "I", 99, "IX"),
+    ("J", 0, "J", 99, "X"),
+    ("K", 0, "K", 93, "XI"),
+    ("L", 0, "L", 99, "XII"),
+    ("M", 0, "M", 99, "XIII"),
+    ("N", 0, "N", 99, "XIV"),
+    ("O", 0, "O", 99, "XV"),
+    ("P", 0, "P", 96, "XVI"),
+    ("Q", 0, "Q", 99, "XVII"),
+    ("R", 0, "R", 99, "XVIII"),
+    ("S", 0, "T", 98, "XIX"),
+    ("V", 1, "Y", 98, "XX"),
+    ("Z", 0, "Z", 99, "XXI"),
+    ("U", 0, "U", 99, "XXII"),
+]
+
+# Female-only (pregnancy, female genital organs) and male-only code ranges.
+FEMALE_CODE_RANGES = [("O", 0, 99), ("N", 70, 98), ("C", 51, 58)]
+MALE_CODE_RANGES = [("N", 40, 51), ("C", 60, 63)]
+
+
+def icd_chapter(code):
+    """Returns the ICD-10 chapter (roman numeral) of a code, or None."""
+    match = ICD_CODE_RE.match(code)
+    if not match:
+        return None
+    key = (match.group(1), int(match.group(2)))
+    for first_letter, first_num, last_letter, last_num, chapter in ICD_CHAPTERS:
+        if (first_letter, first_num) <= key <= (last_letter, last_num):
+            return chapter
+    return None
+
+
+def protocol_codes(text, window=3000):
+    """ICD-10 codes from the protocol's code table (the text right after 'МКБ-10')."""
+    start = text.find("МКБ")
+    section = text[start : start + window] if start != -1 else text
+    return [m.group(0) for m in ICD_CODE_RE.finditer(section)]
+
+
+def _has(text, markers):
+    return any(marker in text for marker in markers)
+
+
+def _in_ranges(codes, ranges):
+    for code in codes:
+        match = ICD_CODE_RE.match(code)
+        letter, number = match.group(1), int(match.group(2))
+        if any(letter == l and lo <= number <= hi for l, lo, hi in ranges):
+            yield code
+
+
+def age_group(title, text):
+    """Only tags protocols that are clearly pediatric or adult; everything else is "all"."""
+    title = title.lower()
+    pediatric, adult = _has(title, PEDIATRIC_MARKERS), _has(title, ADULT_MARKERS)
+    if pediatric and adult:
+        return "all"
+    if pediatric:
+        return "pediatric"
+    if adult:
+        return "adult"
+    match = PATIENT_CATEGORY_RE.search(text)
+    if match:
+        category = match.group(1).lower()
+        children = "дети" in category or "детск" in category
+        adults = "взросл" in category
+        if children and not adults:
+            return "pediatric"
+        if adults and not children:
+            return "adult"
+    return "all"
+
+
+def sex(title, codes):
+    if codes:
+        female = sum(1 for _ in _in_ranges(codes, FEMALE_CODE_RANGES))
+        male = sum(1 for _ in _in_ranges(codes, MALE_CODE_RANGES))
+        if female == len(codes):
+            return "female"
+        if male == len(codes):
+            return "male"
+    title = title.lower()
+    if _has(title, FEMALE_MARKERS) and not _has(title, MALE_MARKERS):
+        return "female"
+    if _has(title, MALE_MARKERS) and not _has(title, FEMALE_MARKERS):
+        return "male"
+    return "all"
+
+
+def protocol_tags(title, text):
+    """Payload tags for all chunks of one protocol, from its title and full text."""
+    codes = protocol_codes(text)
+    chapters = sorted({c for c in map(icd_chapter, codes) if c})
+    return {
+        "age_group": age_group(title, text),
+        "sex": sex(title, codes),
+        "icd_chapters": chapters,
+    }
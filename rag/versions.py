@@ -0,0 +1,143 @@
+"""
+Versioned index builds and the manifest read by the server.
+
+ingest.py writes every build into its own directory under ../indexes
+(<version>/qdrant) while the server keeps serving the previous one, then
+publish_version() atomically replaces manifest.json to make it current.
+The server (src/index_versions.py) picks the new version up through
+POST /admin/reload or by watching the manifest, and releases the old one
+once its in-flight requests are done.
+
+Files derived from the protocols (digests.json, icd_codes.json) are written
+into the version directory before publishing and listed in its manifest
+entry ("digests", "code_index"), so the server reads them from the version
+it serves.
+
+Old builds are kept unless publish_version() is given keep=N (ingest.py:
+KEEP_VERSIONS); then only the newest N are kept. A directory is never
+removed while a live server process has that version open. The server marks
+open versions with .in_use.<pid>.<n> files (IN_USE_PREFIX). The pid check
+assumes ingestion runs on the same host and in the same pid namespace as the
+server, so leave pruning off otherwise.
+"""
+
+import json
+import os
+import pathlib
+import shutil
+import time
+import uuid
+
+SCRIPT_DIR = pathlib.Path(__file__).parent.resolve()
+INDEX_DIR = SCRIPT_DIR / "../indexes"
+MANIFEST_NAME = "manifest.json"
+# Written by src/index_versions.py into a version directory while it is open.
+IN_USE_PREFIX = ".in_use."
+
+
+def new_version(index_dir=INDEX_DIR):
+    """Name of a new build, "<timestamp>-<random suffix>"; claims its directory.
+
+    Names sort by creation time. The directory is created here, so two
+    ingests started in the same second never write into the same build.
+    """
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    (pathlib.Path(index_dir) / version).mkdir(parents=True, exist_ok=False)
+    return version
+
+
+def version_path(version, index_dir=INDEX_DIR):
+    """Local Qdrant path of one index version."""
+    return pathlib.Path(index_dir) / version / "qdrant"
+
+
+def artifact_path(version, name, index_dir=INDEX_DIR):
+    """A file built with a version (digests, code index), next to its Qdrant store."""
+    return pathlib.Path(index_dir) / version / name
+
+
+def read_manifest(index_dir=INDEX_DIR):
+    path = pathlib.Path(index_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"current": None, "versions": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_index(index_dir=INDEX_DIR):
+    """(qdrant_path, collection) of the current version, or None without a manifest."""
+    manifest = read_manifest(index_dir)
+    if not manifest["current"]:
+        return None
+    entry = manifest["versions"][manifest["current"]]
+    return str(pathlib.Path(index_dir) / entry["qdrant_path"]), entry["collection"]
+
+
+def current_artifact(key, index_dir=INDEX_DIR):
+    """Path of an artifact ("digests", "code_index") of the current version, or None."""
+    manifest = read_manifest(index_dir)
+    entry = manifest["versions"].get(manifest["current"]) if manifest["current"] else None
+    if not entry or not entry.get(key):
+        return None
+    return pathlib.Path(index_dir) / entry[key]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def in_use(version, index_dir=INDEX_DIR):
+    """True if a live server process has the version open; stale markers are removed."""
+    live = False
+    for marker in (pathlib.Path(index_dir) / version).glob(f"{IN_USE_PREFIX}*"):
+        try:
+            pid = int(marker.name[len(IN_USE_PREFIX) :].split(".")[0])
+        except ValueError:
+            continue
+        if _pid_alive(pid):
+            live = True
+        else:
+            marker.unlink(missing_ok=True)
+    return live
+
+
+def publish_version(version, collection, index_dir=INDEX_DIR, keep=None, **info):
+    """Makes a finished build current; with keep=N prunes older builds. Returns the manifest.
+
+    Never prunes the new version or one a running server has open (in_use).
+    """
+    index_dir = pathlib.Path(index_dir)
+    manifest = read_manifest(index_dir)
+    manifest["versions"][version] = {
+        "qdrant_path": f"{version}/qdrant",
+        "collection": collection,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **info,
+    }
+    manifest["current"] = version
+
+    pruned = []
+    if keep:
+        pruned = [
+            old
+            for old in sorted(manifest["versions"])[:-keep]
+            if old != version and not in_use(old, index_dir)
+        ]
+    for old in pruned:
+        del manifest["versions"][old]
+
+    # Write next to the manifest and rename: readers never see a partial file.
+    tmp_path = index_dir / f".{MANIFEST_NAME}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, index_dir / MANIFEST_NAME)
+
+    for old in pruned:
+        shutil.rmtree(index_dir / old, ignore_errors=True)
+    return manifest
@@ -0,0 +1,178 @@
+"""
+Контроль допуска запросов /diagnose.
+
+Одновременно обслуживается не более ADMISSION_MAX_CONCURRENT запросов
+(каждый держит не больше одного вызова LLM и одного эмбеддинга), остальные
+ждут в очереди с приоритетами. Если очередь заполнена, запрос сразу
+получает 429, если ожидание превысило ADMISSION_QUEUE_TIMEOUT_S — 503;
+в обоих случаях с заголовком Retry-After.
+
+Приоритет задаётся заголовком X-Priority: interactive (по умолчанию) или
+batch. Пакетные запросы занимают не больше ADMISSION_BATCH_QUEUE_SHARE
+очереди и обслуживаются только когда нет ожидающих интерактивных.
+
+Настройки (переменные окружения):
+    ADMISSION_MAX_CONCURRENT     — одновременно обслуживаемых запросов (8)
+    ADMISSION_MAX_QUEUED         — максимальная длина очереди (32)
+    ADMISSION_QUEUE_TIMEOUT_S    — максимальное ожидание в очереди, с (10)
+    ADMISSION_BATCH_QUEUE_SHARE  — доля очереди для batch-запросов (0.5)
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from src.metrics import Counter, Gauge, Histogram, record_stage
+
+LANES = {"interactive": 0, "batch": 1}
+DEFAULT_LANE = "interactive"
+
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "admission_queue_seconds",
+    "Время ожидания в очереди допуска.",
+    ["lane"],
+)
+ADMISSION_SERVICE_SECONDS = Histogram(
+    "admission_service_seconds",
+    "Время обслуживания запроса после допуска.",
+    ["lane"],
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Запросы, отклонённые контролем допуска.",
+    ["lane", "reason"],
+)
+ADMISSION_ACTIVE = Gauge(
+    "admission_active_requests",
+    "Запросы, обслуживаемые в данный момент.",
+)
+ADMISSION_QUEUED = Gauge(
+    "admission_queued_requests",
+    "Запросы, ожидающие в очереди допуска.",
+)
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен; status_code — 429 или 503."""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def parse_lane(value) -> str:
+    lane = (value or "").strip().lower()
+    return lane if lane in LANES else DEFAULT_LANE
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queued: int,
+        queue_timeout_s: float,
+        batch_queue_share: float = 0.5,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout_s = queue_timeout_s
+        self.batch_queue_share = batch_queue_share
+        self.active = 0
+        # Куча (приоритет, порядковый номер, future); future получает
+        # результат, когда освободившийся слот передаётся ожидающему.
+        self._waiters: list = []
+        self._seq = itertools.count()
+        # Скользящее среднее времени обслуживания — для оценки Retry-After.
+        self._service_avg_s = 1.0
+
+    def _queue_limit(self, lane: str) -> int:
+        if lane == "batch":
+            return int(self.max_queued * self.batch_queue_share)
+        return self.max_queued
+
+    def retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._service_avg_s * backlog / self.max_concurrent))
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.set(self.active)
+        ADMISSION_QUEUED.set(len(self._waiters))
+
+    async def acquire(self, lane: str):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._update_gauges()
+            return
+
+        if len(self._waiters) >= self._queue_limit(lane):
+            raise AdmissionRejected(429, self.retry_after(), "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (LANES[lane], next(self._seq), future))
+        self._update_gauges()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout_s)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        if not future.done():
+            self._abandon(future)
+            raise AdmissionRejected(503, self.retry_after(), "queue_timeout")
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done():
+            # Слот уже был передан этому запросу — возвращаем его.
+            self.release()
+            return
+        future.cancel()
+        self._waiters = [w for w in self._waiters if w[2] is not future]
+        heapq.heapify(self._waiters)
+        self._update_gauges()
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                self._update_gauges()
+                return
+        self.active -= 1
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def slot(self, lane: str = DEFAULT_LANE):
+        """Ждёт свободный слот; время в очереди и обслуживания пишутся отдельно."""
+        queued_at = time.perf_counter()
+        try:
+            await self.acquire(lane)
+        except AdmissionRejected as e:
+            ADMISSION_REJECTED.inc(lane=lane, reason=e.reason)
+            raise
+        queue_s = time.perf_counter() - queued_at
+        ADMISSION_QUEUE_SECONDS.observe(queue_s, lane=lane)
+        record_stage("queue", queue_s)
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            service_s = time.perf_counter() - started_at
+            ADMISSION_SERVICE_SECONDS.observe(service_s, lane=lane)
+            record_stage("service", service_s)
+            self._service_avg_s = 0.9 * self._service_avg_s + 0.1 * service_s
+            self.release()
+
+
+def controller_from_env() -> AdmissionController:
+    return AdmissionController(
+        max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "8")),
+        max_queued=int(os.getenv("ADMISSION_MAX_QUEUED", "32")),
+        queue_timeout_s=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "10")),
+        batch_queue_share=float(os.getenv("ADMISSION_BATCH_QUEUE_SHARE", "0.5")),
+    )
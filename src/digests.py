@@ -0,0 +1,95 @@
+"""
+Выжимки протоколов для промпта (PROMPT_MODE=digest).
+
+rag/build_digests.py заранее сокращает каждый протокол до таблицы кодов
+МКБ-10, определения и диагностических критериев (~2 тыс. символов вместо
+десятков тысяч). В режиме digest сервер подставляет в промпт выжимки
+протоколов, найденных поиском, а не сами фрагменты: промпт короче, и
+модель видит все коды протокола, даже если их таблица не попала в
+найденные фрагменты. Для протоколов без выжимки остаются фрагменты.
+
+Выжимки занимают не больше места, чем контекст из фрагментов, который они
+заменяют (и не больше DIGEST_MAX_CHARS, если задан): протоколы добавляются
+в порядке поиска, пока помещаются. Если не помещается даже первая выжимка,
+в промпт идут фрагменты.
+
+Выжимки строит rag/ingest.py в каталоге версии индекса и читаются они из
+версии, на которой работает сервер. Без манифеста (или для версии без
+выжимок) — файл DIGESTS_PATH (по умолчанию ./digests.json). Число
+протоколов в промпте — DIGEST_MAX_PROTOCOLS.
+"""
+
+import json
+import os
+from functools import lru_cache
+
+from src.index_versions import served_spec
+from src.metrics import Counter
+
+DIGESTS_PATH = os.getenv("DIGESTS_PATH", "./digests.json")
+DIGEST_MAX_PROTOCOLS = int(os.getenv("DIGEST_MAX_PROTOCOLS", "5"))
+# Предел длины контекста из выжимок в символах; 0 — длина контекста из фрагментов.
+DIGEST_MAX_CHARS = int(os.getenv("DIGEST_MAX_CHARS", "0"))
+
+PROMPT_PROTOCOLS = Counter(
+    "prompt_protocols_total",
+    "Протоколы в промпте: digest — выжимкой, chunks — фрагментами (выжимки нет или она не помещается).",
+    ["source"],
+)
+
+
+def load_digests() -> dict[str, dict]:
+    """Выжимки текущей версии индекса или из DIGESTS_PATH."""
+    spec = served_spec()
+    return read_digests((spec and spec.digests_path) or DIGESTS_PATH)
+
+
+@lru_cache(maxsize=2)
+def read_digests(path: str) -> dict[str, dict]:
+    """{source_file: {"digest", "codes", "content_hash", ...}}; пустой словарь без файла."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return data.get("protocols", {})
+
+
+def chunk_context(docs) -> str:
+    """Контекст промпта из найденных фрагментов.
+
+    Общие для нескольких протоколов фрагменты приходят по копии на протокол
+    и попадают в контекст один раз.
+    """
+    return "\n\n".join(dict.fromkeys(doc.page_content for doc in docs))
+
+
+def digest_context(
+    docs, max_protocols: int = DIGEST_MAX_PROTOCOLS, max_chars: int = DIGEST_MAX_CHARS
+) -> str:
+    """Контекст промпта из выжимок протоколов найденных фрагментов (в порядке поиска)."""
+    digests = load_digests()
+    chunks_by_file: dict[str, list[str]] = {}
+    for doc in docs:
+        chunks_by_file.setdefault(doc.metadata.get("source_file"), []).append(doc.page_content)
+
+    fallback = chunk_context(docs)
+    budget = min(max_chars, len(fallback)) if max_chars > 0 else len(fallback)
+    parts, sources, used = [], [], 0
+    for source_file, chunks in list(chunks_by_file.items())[:max_protocols]:
+        entry = digests.get(source_file)
+        source = "digest" if entry else "chunks"
+        text = entry["digest"] if entry else "\n\n".join(dict.fromkeys(chunks))
+        size = len(text) + (2 if parts else 0)
+        if used + size > budget:
+            break
+        parts.append(text)
+        sources.append(source)
+        used += size
+
+    if not parts:
+        PROMPT_PROTOCOLS.inc(len(chunks_by_file), source="chunks")
+        return fallback
+    for source in sources:
+        PROMPT_PROTOCOLS.inc(source=source)
+    return "\n\n".join(parts)
@@ -0,0 +1,328 @@
+"""
+Версии индекса протоколов и их замена без остановки сервера.
+
+rag/ingest.py строит каждую версию индекса в отдельном каталоге
+(indexes/<версия>/qdrant) и, когда она готова, атомарно переписывает
+манифест indexes/manifest.json:
+    {"current": "20260101-120000-3f9a1c",
+     "versions": {"20260101-120000-3f9a1c": {"qdrant_path": "20260101-120000-3f9a1c/qdrant",
+                                             "collection": "...",
+                                             "digests": "20260101-120000-3f9a1c/digests.json",
+                                             "code_index": "20260101-120000-3f9a1c/icd_codes.json",
+                                             ...}}}
+
+Выжимки и индекс кодов МКБ-10 строятся вместе с версией, до её публикации,
+и читаются из версии, на которой работает процесс (served_spec()): после
+замены индекса сервер не подхватывает устаревшие файлы.
+
+IndexManager держит открытой текущую версию. reload() читает манифест,
+открывает новую версию рядом со старой и атомарно переключается на неё.
+Запросы, начатые на старой версии (acquire()), дорабатывают на ней; после
+последнего из них старая версия закрывается, и её каталог можно удалять.
+Без манифеста используется прежний фиксированный индекс (QDRANT_PATH).
+
+При смене версии вызываются обработчики on_version_change() — сервер
+сбрасывает в них кэши, построенные по старому индексу.
+
+Перезагрузка: POST /admin/reload или опрос манифеста раз в INDEX_WATCH_S
+секунд (0 — не опрашивать).
+
+Пока версия открыта, в её каталоге лежит метка .in_use.<pid>.<n>:
+rag/versions.py не удаляет при очистке каталоги с меткой живого процесса.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Optional
+
+from src.logs import get_logger, log_event
+from src.metrics import Counter, Gauge
+
+INDEX_MANIFEST = os.getenv("INDEX_MANIFEST", "./indexes/manifest.json")
+INDEX_WATCH_S = float(os.getenv("INDEX_WATCH_S", "0"))
+
+# Префикс метки открытой версии; то же имя проверяет rag/versions.py.
+IN_USE_PREFIX = ".in_use."
+
+INDEX_SWAPS = Counter(
+    "index_swaps_total",
+    "Переключения на новую версию индекса.",
+)
+INDEX_VERSION = Gauge(
+    "index_version_info",
+    "Версия индекса: 1 — текущая, 0 — заменённая.",
+    ["version"],
+)
+
+logger = get_logger("index")
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    version: str
+    qdrant_path: str
+    collection: str
+    # Артефакты версии; None — версия собрана без них (берутся файлы по умолчанию).
+    digests_path: Optional[str] = None
+    code_index_path: Optional[str] = None
+
+
+def read_manifest(path: str = INDEX_MANIFEST, version: Optional[str] = None) -> Optional[IndexSpec]:
+    """Версия из манифеста (по умолчанию текущая); None, если манифеста или версии нет."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    version = version or manifest["current"]
+    entry = manifest["versions"].get(version)
+    if entry is None:
+        return None
+
+    # Пути в манифесте — относительно его каталога.
+    def resolve(key):
+        return os.path.join(os.path.dirname(path), entry[key]) if entry.get(key) else None
+
+    return IndexSpec(
+        version,
+        resolve("qdrant_path"),
+        entry["collection"],
+        digests_path=resolve("digests"),
+        code_index_path=resolve("code_index"),
+    )
+
+
+_listeners: list[Callable[[str], None]] = []
+_seen_version: Optional[str] = None
+_seen_lock = threading.Lock()
+
+
+def on_version_change(listener: Callable[[str], None]):
+    """Регистрирует обработчик смены версии индекса (получает новую версию)."""
+    _listeners.append(listener)
+
+
+def note_version(version: Optional[str]):
+    """Запоминает версию индекса, на которой выполнен запрос; при смене вызывает обработчики.
+
+    В многопроцессном режиме индекс открыт в src.retrieval_worker, и
+    воркеры API узнают о новой версии из ответов на поисковые запросы.
+    """
+    global _seen_version
+    if version is None:
+        return
+    with _seen_lock:
+        previous, _seen_version = _seen_version, version
+    if previous is None or previous == version:
+        return
+    for listener in _listeners:
+        try:
+            listener(version)
+        except Exception as e:
+            log_event(
+                logger,
+                logging.ERROR,
+                "Ошибка обработчика смены версии индекса",
+                version=version,
+                error=f"{type(e).__name__}: {e}",
+            )
+
+
+def seen_version() -> Optional[str]:
+    """Последняя известная этому процессу версия индекса."""
+    return _seen_version
+
+
+@lru_cache(maxsize=16)
+def _published_spec(version: str) -> Optional[IndexSpec]:
+    # Запись опубликованной версии в манифесте не меняется.
+    return read_manifest(INDEX_MANIFEST, version)
+
+
+def served_spec() -> Optional[IndexSpec]:
+    """Версия, на которой работает процесс (до первого запроса — текущая по манифесту).
+
+    Воркеры API в многопроцессном режиме индекс не открывают и знают
+    только номер версии (note_version); её артефакты ищутся в манифесте.
+    """
+    version = _seen_version
+    if version is None:
+        return read_manifest(INDEX_MANIFEST)
+    return _published_spec(version)
+
+
+class IndexHandle:
+    """Открытая версия индекса и число выполняющихся на ней запросов."""
+
+    def __init__(self, spec: IndexSpec, vectorstore, marker: Optional[str] = None):
+        self.spec = spec
+        self.vectorstore = vectorstore
+        self.marker = marker
+        self.active = 0
+        self.retired = False
+
+    @property
+    def version(self) -> str:
+        return self.spec.version
+
+
+class IndexManager:
+    """Текущая версия индекса с заменой без остановки (см. описание модуля)."""
+
+    def __init__(
+        self,
+        open_index: Callable[[IndexSpec], object],
+        default_spec: IndexSpec,
+        manifest_path: str = INDEX_MANIFEST,
+    ):
+        self._open_index = open_index
+        self.default_spec = default_spec
+        self.manifest_path = manifest_path
+        self._current: Optional[IndexHandle] = None
+        # _lock защищает _current и счётчики; _reload_lock — одна загрузка за раз.
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._manifest_mtime: Optional[float] = None
+        self._marker_ids = itertools.count()
+
+    def _manifest_stat(self) -> Optional[float]:
+        try:
+            return os.stat(self.manifest_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def target_spec(self) -> IndexSpec:
+        return read_manifest(self.manifest_path) or self.default_spec
+
+    def _mark_in_use(self, spec: IndexSpec) -> Optional[str]:
+        """Создаёт метку открытой версии в её каталоге (только для версий из манифеста)."""
+        if spec == self.default_spec:
+            return None
+        marker = os.path.join(
+            os.path.dirname(spec.qdrant_path),
+            f"{IN_USE_PREFIX}{os.getpid()}.{next(self._marker_ids)}",
+        )
+        try:
+            with open(marker, "w", encoding="utf-8"):
+                pass
+        except OSError as e:
+            log_event(
+                logger,
+                logging.WARNING,
+                "Не удалось отметить версию индекса как используемую",
+                version=spec.version,
+                error=f"{type(e).__name__}: {e}",
+            )
+            return None
+        return marker
+
+    def current(self) -> IndexHandle:
+        """Текущая версия; при первом вызове открывает её."""
+        if self._current is None:
+            self.reload()
+        return self._current
+
+    @contextmanager
+    def acquire(self):
+        """Версия индекса для одного запроса: не закрывается, пока запрос не завершён."""
+        self.current()
+        with self._lock:
+            handle = self._current
+            handle.active += 1
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.active -= 1
+                release = handle.retired and handle.active == 0
+            if release:
+                self._release(handle)
+
+    def manifest_changed(self) -> bool:
+        return self._manifest_stat() != self._manifest_mtime
+
+    def reload(self) -> dict:
+        """Переключается на версию из манифеста, если она отличается от текущей."""
+        with self._reload_lock:
+            mtime = self._manifest_stat()
+            spec = self.target_spec()
+            previous = self._current
+            if previous is not None and previous.spec == spec:
+                self._manifest_mtime = mtime
+                return {"version": spec.version, "previous": spec.version, "changed": False}
+
+            # Долгая загрузка идёт рядом со старой версией, которая продолжает отвечать.
+            try:
+                handle = IndexHandle(spec, self._open_index(spec), self._mark_in_use(spec))
+            except Exception:
+                # Не повторять ту же неудачную загрузку до следующего изменения манифеста.
+                self._manifest_mtime = mtime
+                raise
+            with self._lock:
+                self._current = handle
+                release = False
+                if previous is not None:
+                    previous.retired = True
+                    release = previous.active == 0
+            self._manifest_mtime = mtime
+        if release:
+            self._release(previous)
+
+        INDEX_VERSION.set(1, version=spec.version)
+        if previous is not None:
+            INDEX_SWAPS.inc()
+            INDEX_VERSION.set(0, version=previous.version)
+            log_event(
+                logger,
+                logging.INFO,
+                "Индекс переключён на новую версию",
+                version=spec.version,
+                previous=previous.version,
+            )
+        note_version(spec.version)
+        return {
+            "version": spec.version,
+            "previous": previous.version if previous else None,
+            "changed": True,
+        }
+
+    def _release(self, handle: IndexHandle):
+        """Закрывает заменённую версию; локальная база Qdrant освобождает каталог."""
+        try:
+            handle.vectorstore.client.close()
+            if handle.marker is not None:
+                os.remove(handle.marker)
+        except Exception as e:
+            log_event(
+                logger,
+                logging.WARNING,
+                "Не удалось закрыть старую версию индекса",
+                version=handle.version,
+                error=f"{type(e).__name__}: {e}",
+            )
+            return
+        log_event(logger, logging.INFO, "Старая версия индекса закрыта", version=handle.version)
+
+
+async def watch_manifest(manager: IndexManager, interval_s: float = INDEX_WATCH_S):
+    """Опрашивает манифест и перезагружает индекс при его изменении."""
+    while True:
+        await asyncio.sleep(interval_s)
+        if not manager.manifest_changed():
+            continue
+        try:
+            await asyncio.to_thread(manager.reload)
+        except Exception as e:
+            log_event(
+                logger,
+                logging.ERROR,
+                "Ошибка перезагрузки индекса",
+                error=f"{type(e).__name__}: {e}",
+            )
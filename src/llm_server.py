@@ -4,28 +4,211 @@
 Использование:
     uvicorn src.llm_server:app --host 127.0.0.1 --port 8000
 
+Несколько воркеров (модель и индекс загружаются один раз в отдельном процессе):
+    python -m src.retrieval_worker --socket /tmp/qazcode-retriever.sock
+    RETRIEVER_SOCKET=/tmp/qazcode-retriever.sock \
+        uvicorn src.llm_server:app --host 0.0.0.0 --port 8000 --workers 4
+
 Docker:
     docker build -t diag-server .
     docker run -p 8000:8000 diag-server
 
 Сервер запускается на http://127.0.0.1:8000/diagnose
+
+Адрес LLM задаётся OPENAI_BASE_URL (для локальных тестов без сети —
+python -m src.mock_llm_server и OPENAI_BASE_URL=http://127.0.0.1:8001/v1).
+
+Метрики Prometheus доступны на /metrics. Заголовок Server-Timing с
+разбивкой по этапам включается переменной окружения SERVER_TIMING=1.
+
+Логи пишутся в stdout в формате JSON через очередь (см. src/logs.py);
+каждая запись содержит request_id из заголовка X-Request-ID.
+
+При запуске модель и индекс загружаются в фоне и прогреваются пробным
+запросом (отключается WARMUP=0); /ready отвечает 200 после прогрева и
+возвращает разбивку времени запуска по этапам.
+
+Число одновременно обслуживаемых запросов и длина очереди ограничены
+(см. src/admission.py); при перегрузке сервер отвечает 429/503 с
+Retry-After. Заголовок X-Priority: batch понижает приоритет запроса.
+
+Новая версия индекса (rag/ingest.py) подключается без остановки:
+POST /admin/reload или INDEX_WATCH_S > 0 (см. src/index_versions.py).
+
+PROMPT_MODE=digest подставляет в промпт выжимки найденных протоколов
+(rag/build_digests.py, src/digests.py) вместо исходных фрагментов.
+При SERVER_TIMING=1 заголовок X-LLM-Tokens содержит токены запроса.
 """
 
 from contextlib import asynccontextmanager
 from typing import Optional, List
+import time
+
+_MODULE_LOAD_START = time.perf_counter()
+
+import hmac
 import os
-import openai
-import json
-import re
 import asyncio
+import logging
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from src.retriever import get_retriever
+from src.admission import AdmissionRejected, controller_from_env, parse_lane
+from src.digests import chunk_context, digest_context, load_digests, read_digests
+from src.index_versions import INDEX_WATCH_S, on_version_change, seen_version, watch_manifest
+from src.logs import (
+    get_logger,
+    log_event,
+    log_verbose,
+    new_request_id,
+    setup_logging,
+    shutdown_logging,
+    truncate,
+)
+from src.metrics import (
+    Gauge,
+    LLM_RETRIES,
+    REQUEST_SECONDS,
+    count_tokens,
+    record_stage,
+    render_metrics,
+    request_tokens,
+    server_timing_header,
+    span,
+    start_request_spans,
+)
+from src.parsing import (
+    PARSE_OUTCOMES,
+    DiagnosesParseError,
+    ParseResult,
+    build_repair_prompt,
+    read_code_index,
+    parse_diagnoses,
+)
+from src.prompts import SYSTEM_PROMPT, build_prompt
+from src.retriever import (
+    RETRIEVER_SOCKET,
+    aretrieve,
+    index_manager,
+    reload_index,
+)
 
 load_dotenv()
 
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# Паузы между попытками прогрева, пока воркер поиска (RETRIEVER_SOCKET) не отвечает.
+WARMUP_RETRY_MIN_S = 0.5
+WARMUP_RETRY_MAX_S = 10.0
+# "chunks" — найденные фрагменты в промпте, "digest" — выжимки протоколов (src/digests.py).
+PROMPT_MODE = os.getenv("PROMPT_MODE", "chunks")
+# POST /admin/reload доступен только с заголовком X-Admin-Token с этим значением;
+# без ADMIN_TOKEN эндпоинт отключён (404).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+logger = get_logger("server")
+admission = controller_from_env()
+
+STARTUP_SECONDS = Gauge(
+    "startup_seconds",
+    "Длительность этапов запуска сервера.",
+    ["phase"],
+)
+startup_state = {"ready": False, "phases": {}, "error": None}
+_llm_client = None
+
+
+def get_llm_client():
+    """Клиент LLM создаётся один раз; openai импортируется при первом вызове."""
+    global _llm_client
+    if _llm_client is None:
+        import openai
+
+        _llm_client = openai.AsyncOpenAI(
+            base_url=os.getenv("OPENAI_BASE_URL", "https://hub.qazcode.ai"),
+            api_key=os.getenv("OPENAI_API_KEY", "sk-BDVloWBwHCr5oltlXwyhtA"),
+            # Повторы делает diagnose(): каждый виден в llm_retries_total и в спанах.
+            max_retries=0,
+        )
+    return _llm_client
+
+
+def invalidate_caches(version: str):
+    """Сбрасывает кэши артефактов по фиксированным путям (DIGESTS_PATH, ICD_CODE_INDEX).
+
+    Артефакты из каталога версии кэшируются по пути и сброса не требуют;
+    файлы по умолчанию могли быть перестроены вместе с новой версией.
+    """
+    read_digests.cache_clear()
+    read_code_index.cache_clear()
+    log_event(logger, logging.INFO, "Кэши сброшены после смены индекса", version=version)
+
+
+on_version_change(invalidate_caches)
+
+
+def _record_startup_phase(phase: str, duration_s: float):
+    startup_state["phases"][phase] = round(duration_s, 3)
+    STARTUP_SECONDS.set(duration_s, phase=phase)
+
+
+async def _warmup_query():
+    """Пробный поиск. Воркер поиска может подняться позже сервера: пока
+    сокет не отвечает, запрос повторяется с растущей паузой."""
+    wait_start = time.perf_counter()
+    delay = WARMUP_RETRY_MIN_S
+    while True:
+        start = time.perf_counter()
+        try:
+            await aretrieve("warm-up", k=1)
+            break
+        except OSError as e:
+            if not RETRIEVER_SOCKET:
+                raise
+            startup_state["error"] = f"{type(e).__name__}: {e}"
+            log_event(
+                logger,
+                logging.WARNING,
+                "Воркер поиска недоступен, прогрев будет повторён",
+                error=startup_state["error"],
+                retry_in_s=delay,
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+    if startup_state["error"] is not None:
+        startup_state["error"] = None
+        _record_startup_phase("retriever_wait", start - wait_start)
+    _record_startup_phase("warmup_query", time.perf_counter() - start)
+
+
+async def warm_up():
+    """Загружает модель и индекс и выполняет пробный поиск до готовности (/ready)."""
+    try:
+        start = time.perf_counter()
+        await asyncio.to_thread(get_llm_client)
+        _record_startup_phase("llm_client", time.perf_counter() - start)
+
+        if not RETRIEVER_SOCKET:
+            start = time.perf_counter()
+            await asyncio.to_thread(index_manager.current)
+            _record_startup_phase("retriever_init", time.perf_counter() - start)
+
+        if PROMPT_MODE == "digest":
+            start = time.perf_counter()
+            await asyncio.to_thread(load_digests)
+            _record_startup_phase("digests", time.perf_counter() - start)
+
+        await _warmup_query()
+    except Exception as e:
+        startup_state["error"] = f"{type(e).__name__}: {e}"
+        log_event(logger, logging.ERROR, "Ошибка прогрева", error=startup_state["error"])
+        return
+
+    startup_state["ready"] = True
+    log_event(logger, logging.INFO, "Сервер готов", startup_s=startup_state["phases"])
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -37,12 +220,92 @@ async def lifespan(app: FastAPI):
     print("Документация: /docs")
     print("=" * 40)
     print("\nНажмите Ctrl+C для остановки\n")
-    yield
+    setup_logging()
+    _record_startup_phase("imports", _MODULE_IMPORTED - _MODULE_LOAD_START)
+    warmup_task = None
+    if WARMUP:
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        startup_state["ready"] = True
+    watch_task = None
+    if INDEX_WATCH_S > 0 and not RETRIEVER_SOCKET:
+        watch_task = asyncio.create_task(watch_manifest(index_manager))
+    try:
+        yield
+    finally:
+        for task in (warmup_task, watch_task):
+            if task is not None:
+                task.cancel()
+        shutdown_logging()
 
 
 app = FastAPI(title="Сервер Диагностики", lifespan=lifespan)
 
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Измеряет время запроса и собирает спаны этапов для Server-Timing."""
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    spans = start_request_spans()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        # Необработанная ошибка станет ответом 500 уже за пределами middleware:
+        # учитываем её здесь, иначе ошибки не видны в /metrics.
+        path = getattr(request.scope.get("route"), "path", "other")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, path=path, status="500")
+        logger.exception("Необработанная ошибка запроса", extra={"fields": {"path": path}})
+        raise
+    total_s = time.perf_counter() - start
+    # Шаблон маршрута, а не сырой путь: иначе любой перебор URL порождает новые серии.
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        total_s,
+        path=getattr(route, "path", "other"),
+        status=str(response.status_code),
+    )
+    if SERVER_TIMING and spans:
+        response.headers["Server-Timing"] = server_timing_header(spans, total_s)
+    tokens = request_tokens()
+    if SERVER_TIMING and tokens:
+        response.headers["X-LLM-Tokens"] = ", ".join(f"{k}={v}" for k, v in tokens.items())
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.get("/ready")
+async def handle_ready() -> JSONResponse:
+    """200, когда модель и индекс загружены и прогреты, иначе 503."""
+    return JSONResponse(
+        {**startup_state, "index_version": seen_version()},
+        status_code=200 if startup_state["ready"] else 503,
+    )
+
+
+@app.post("/admin/reload")
+async def handle_reload(x_admin_token: Optional[str] = Header(None)) -> JSONResponse:
+    """Переключает индекс на текущую версию из манифеста без остановки сервера."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+    try:
+        result = await reload_index()
+    except Exception as e:
+        log_event(logger, logging.ERROR, "Ошибка перезагрузки индекса", error=str(e))
+        raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+    return JSONResponse(result)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def handle_metrics() -> PlainTextResponse:
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 class PatientData(BaseModel):
     name: Optional[str] = None
     age: Optional[int] = None
@@ -69,92 +332,127 @@ class DiagnoseResponse(BaseModel):
     diagnoses: list[Diagnosis]
 
 
+async def call_llm(client, user_prompt: str, timeout: float, stage: str) -> str:
+    """Один вызов LLM: возвращает текст ответа, учитывает токены и время этапа."""
+    with span(stage):
+        response = await client.chat.completions.create(
+            model="oss-120b",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"},
+            timeout=timeout,
+        )
+    if response.usage:
+        count_tokens("prompt", response.usage.prompt_tokens)
+        count_tokens("completion", response.usage.completion_tokens)
+    return response.choices[0].message.content or ""
+
+
+async def repair_diagnoses(client, content: str, error: Exception) -> Optional[ParseResult]:
+    """Переспрашивает модель коротким промптом на исправление вместо полного повтора."""
+    repair_prompt = build_repair_prompt(content, str(error))
+    repaired = await call_llm(client, repair_prompt, timeout=15.0, stage="llm_repair")
+    try:
+        with span("parse"):
+            result = parse_diagnoses(repaired)
+    except DiagnosesParseError:
+        PARSE_OUTCOMES.inc(outcome="failed")
+        return None
+    PARSE_OUTCOMES.inc(outcome="repaired")
+    return result
+
+
 @app.post("/diagnose", response_model=DiagnoseResponse)
-async def handle_diagnose(request: DiagnoseRequest) -> DiagnoseResponse:
+async def handle_diagnose(
+    request: DiagnoseRequest,
+    x_priority: Optional[str] = Header(None),
+) -> DiagnoseResponse:
     """Обрабатывает POST запросы /diagnose."""
+    lane = parse_lane(x_priority)
+    try:
+        async with admission.slot(lane):
+            return await diagnose(request)
+    except AdmissionRejected as e:
+        log_event(
+            logger,
+            logging.WARNING,
+            "Запрос отклонён контролем допуска",
+            lane=lane,
+            reason=e.reason,
+        )
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def diagnose(request: DiagnoseRequest) -> DiagnoseResponse:
+    """Подбирает диагнозы: поиск по протоколам, запрос к LLM, разбор ответа."""
     symptoms = request.symptoms or ""
     patient_data = request.patient_data
 
-    client = openai.AsyncOpenAI(
-        base_url="https://hub.qazcode.ai",
-        api_key="sk-BDVloWBwHCr5oltlXwyhtA",
-    )
-    retriever = get_retriever(k=10)
-    context = retriever.invoke(symptoms)
-    context_str = "\n\n".join([doc.page_content for doc in context])
+    client = get_llm_client()
+    import openai  # уже загружен get_llm_client()
 
-    print("Извлеченные документы:")
-    for doc in context:
-        print(doc.metadata["source_file"])
+    with span("retrieval"):
+        patient = None
+        if patient_data:
+            patient = {"age": patient_data.age, "gender": patient_data.gender}
+        context = await aretrieve(symptoms, k=10, patient=patient)
+    if PROMPT_MODE == "digest":
+        context_str = digest_context(context)
+    else:
+        context_str = chunk_context(context)
 
-    prompt = f"""Вы — система поддержки принятия клинических решений, обученная на казахстанских клинических протоколах.
-Ваша задача — проанализировать симптомы и данные пациента, сопоставить их с информацией из клинических протоколов и предложить до 3 наиболее вероятных диагнозов с кодами по МКБ-10.
+    log_verbose(
+        logger,
+        "Извлеченные документы",
+        source_files=[doc.metadata["source_file"] for doc in context],
+    )
 
-ПАЦИЕНТ:
-- Симптомы: {symptoms}
-"""
-    if patient_data:
-        prompt += f"- Возраст: {patient_data.age}\n" if patient_data.age else ""
-        prompt += f"- Пол: {patient_data.gender}\n" if patient_data.gender else ""
-        if patient_data.medicalHistory:
-            prompt += f"- История болезни: {', '.join(patient_data.medicalHistory)}\n"
-        if patient_data.currentMedications:
-            prompt += f"- Текущие препараты: {', '.join(patient_data.currentMedications)}\n"
-        if patient_data.allergies:
-            prompt += f"- Аллергии: {', '.join(patient_data.allergies)}\n"
-        if patient_data.recentLabs:
-            prompt += "- Последние анализы:\n"
-            for lab in patient_data.recentLabs:
-                prompt += f"  - {lab['name']}: {lab['value']} {lab['unit']} (норма: {lab['normalRange']})\n"
-        if patient_data.previousDiagnoses:
-            prompt += "- Предыдущие диагнозы:\n"
-            for diag in patient_data.previousDiagnoses:
-                prompt += f"  - {diag['diagnosis']} ({diag['date']})\n"
-
-    prompt += f"""
-КОНТЕКСТ ИЗ КЛИНИЧЕСКИХ ПРОТОКОЛОВ:
-{context_str}
-
-ЗАДАНИЕ:
-1.  Проанализируйте предоставленную информацию.
-2.  Определите 3 наиболее вероятных диагноза.
-3.  Для каждого диагноза укажите его название, код по МКБ-10 и краткое, но профессиональное обоснование, почему этот диагноз может быть релевантен, основываясь на симптомах, данных пациента и контексте из протоколов.
-4.  Ответ верните СТРОГО в формате JSON, без какого-либо дополнительного текста.
-
-ФОРМАТ ОТВЕТА (JSON):
-{{
-  "diagnoses": [
-    {{
-      "rank": 1,
-      "diagnosis": "Название диагноза",
-      "icd10_code": "X00.0",
-      "explanation": "Обоснование..."
-    }},
-    ...
-  ]
-}}
-"""
+    prompt_start = time.perf_counter()
+    prompt = build_prompt(symptoms, patient_data, context_str)
+    record_stage("prompt", time.perf_counter() - prompt_start)
 
     for i in range(3):
         try:
-            response = await client.chat.completions.create(
-                model="oss-120b",
-                messages=[
-                    {"role": "system", "content": "Вы — система поддержки принятия клинических решений. Ваша задача — помочь в диагностике заболеваний на основе предоставленных данных. Ответ должен быть в формате JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                timeout=30.0,
-            )
-            diagnoses_data = json.loads(response.choices[0].message.content)["diagnoses"]
-            diagnoses = [Diagnosis(**d) for d in diagnoses_data]
-            return DiagnoseResponse(diagnoses=diagnoses)
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Попытка {i+1}: Ошибка декодирования JSON: {e}")
-            print(f"Ответ LLM: {response.choices[0].message.content if 'response' in locals() else 'No response'}")
-        except asyncio.TimeoutError:
-            print(f"Попытка {i+1}: Таймаут запроса к API.")
+            content = await call_llm(client, prompt, timeout=30.0, stage="llm")
+            try:
+                with span("parse"):
+                    result = parse_diagnoses(content)
+                PARSE_OUTCOMES.inc(outcome="salvaged" if result.salvaged else "clean")
+            except DiagnosesParseError as e:
+                log_event(
+                    logger,
+                    logging.WARNING,
+                    "Ошибка разбора ответа LLM",
+                    attempt=i + 1,
+                    error=str(e),
+                )
+                log_verbose(logger, "Ответ LLM", attempt=i + 1, llm_output=content)
+                result = await repair_diagnoses(client, content, e)
+                if result is None:
+                    LLM_RETRIES.inc(reason="json")
+                    continue
+            return DiagnoseResponse(diagnoses=[Diagnosis(**d) for d in result.diagnoses])
+        except (asyncio.TimeoutError, openai.APITimeoutError):
+            LLM_RETRIES.inc(reason="timeout")
+            log_event(logger, logging.WARNING, "Таймаут запроса к API", attempt=i + 1)
         except Exception as e:
-            print(f"Попытка {i+1}: Произошла ошибка: {e}")
+            LLM_RETRIES.inc(reason="error")
+            log_event(
+                logger,
+                logging.WARNING,
+                "Произошла ошибка",
+                attempt=i + 1,
+                error=truncate(str(e), 500),
+            )
 
+    log_event(logger, logging.ERROR, "Все попытки вызова LLM исчерпаны")
     return DiagnoseResponse(diagnoses=[])
+
+
+_MODULE_IMPORTED = time.perf_counter()
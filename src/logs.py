@@ -0,0 +1,193 @@
+"""
+Структурированное логирование сервера диагностики.
+
+Записи уходят в очередь (QueueHandler) и пишутся в stdout отдельным
+потоком (QueueListener) в формате JSON, одна строка на запись, так что
+event loop не блокируется на выводе. При переполнении очереди записи
+отбрасываются и учитываются в счётчике log_records_dropped_total.
+
+Настройки (переменные окружения):
+    LOG_LEVEL              — уровень логирования (INFO)
+    LOG_SAMPLE_RATE        — доля запросов, для которых пишутся подробные
+                             данные (список документов, сырой ответ LLM), 0..1 (0.1)
+    LOG_MAX_PAYLOAD_CHARS  — ограничение длины подробных полей (2000)
+    LOG_QUEUE_SIZE         — размер очереди записей (10000)
+"""
+
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+import zlib
+from typing import Optional
+
+from src.metrics import Counter
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_MAX_PAYLOAD_CHARS = int(os.getenv("LOG_MAX_PAYLOAD_CHARS", "2000"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Сколько ждать места в полной очереди для сигнала остановки при shutdown.
+SHUTDOWN_WAIT_S = 1.0
+
+LOG_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Записи лога, отброшенные из-за переполнения очереди.",
+)
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "request_id", default=None
+)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Устанавливает идентификатор текущего запроса (из X-Request-ID или новый)."""
+    request_id = (incoming or "").strip()[:64] or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def is_sampled() -> bool:
+    """Решение о сэмплировании принимается один раз на запрос по его ID."""
+    if LOG_SAMPLE_RATE >= 1:
+        return True
+    if LOG_SAMPLE_RATE <= 0:
+        return False
+    request_id = _request_id.get()
+    if request_id is None:
+        return False
+    return zlib.crc32(request_id.encode()) % 10_000 < LOG_SAMPLE_RATE * 10_000
+
+
+def truncate(value, limit: int = LOG_MAX_PAYLOAD_CHARS) -> str:
+    """Обрезает строку до limit символов с пометкой об исходной длине."""
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…[truncated, {len(text)} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            payload["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        # Через очередь traceback приходит уже отформатированным в exc_text.
+        exc = record.exc_text
+        if record.exc_info:
+            exc = self.formatException(record.exc_info)
+        if exc:
+            payload["exc"] = truncate(exc)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare() дописывает traceback к msg и обнуляет exc_info;
+        # здесь traceback сохраняется отдельно в exc_text (поле "exc" в JSON).
+        record = copy.copy(record)
+        # request_id берётся в потоке запроса, пока контекст ещё доступен.
+        record.request_id = _request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Стандартный put_nowait() бросает queue.Full при полной очереди, и
+        # поток вывода не останавливается. Ждём, пока он освободит место,
+        # а если не успел — отбрасываем самые старые записи.
+        try:
+            self.queue.put(self._sentinel, timeout=SHUTDOWN_WAIT_S)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    LOG_DROPPED.inc()
+                except queue.Empty:
+                    pass
+
+
+def setup_logging():
+    """Подключает очередь и фоновый поток вывода. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    logger = logging.getLogger("diag")
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers = [_NonBlockingQueueHandler(log_queue)]
+    logger.propagate = False
+
+    _listener = _Listener(log_queue, stream_handler)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся записи и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"diag.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, msg: str, **fields):
+    """Пишет запись с дополнительными полями."""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, extra={"fields": fields})
+
+
+def log_verbose(logger: logging.Logger, msg: str, **fields):
+    """Пишет подробные данные только для сэмплированных запросов, с ограничением длины."""
+    if not is_sampled():
+        return
+    capped = {
+        k: truncate(v) if isinstance(v, str) else v for k, v in fields.items()
+    }
+    log_event(logger, logging.INFO, msg, sampled=True, **capped)
@@ -0,0 +1,242 @@
+"""
+Метрики сервера диагностики в формате Prometheus.
+
+Каждый этап обработки /diagnose оборачивается в span(...): длительность
+попадает в гистограмму diagnose_stage_seconds и в список спанов текущего
+запроса (для заголовка Server-Timing). Экспорт — текстовый формат
+Prometheus на /metrics, без внешних зависимостей.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+        return lines
+
+
+class Gauge:
+    """Текущее значение с метками."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами и метками."""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [counts по бакетам..., sum, count]
+        self._series: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for i, bound in enumerate(self.buckets):
+                    labels = _format_labels(
+                        self.labelnames, key, ("le", _format_value(bound))
+                    )
+                    lines.append(f"{self.name}_bucket{labels} {_format_value(series[i])}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+REGISTRY: list = []
+
+REQUEST_SECONDS = Histogram(
+    "diagnose_request_seconds",
+    "Полное время обработки HTTP-запроса.",
+    ["path", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "diagnose_stage_seconds",
+    "Время отдельных этапов обработки /diagnose.",
+    ["stage"],
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Количество токенов, потраченных на вызовы LLM.",
+    ["kind"],
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "Неудачные попытки вызова LLM по причинам.",
+    ["reason"],
+)
+
+
+def render_metrics() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_request_spans: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar(
+    "request_spans", default=None
+)
+
+
+_request_tokens: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "request_tokens", default=None
+)
+
+
+def start_request_spans() -> list:
+    """Начинает сбор спанов (и токенов LLM) для текущего запроса и возвращает список спанов."""
+    spans: list[tuple[str, float]] = []
+    _request_spans.set(spans)
+    _request_tokens.set({})
+    return spans
+
+
+def count_tokens(kind: str, amount: int):
+    """Учитывает токены LLM в llm_tokens_total и в счётчике текущего запроса."""
+    LLM_TOKENS.inc(amount, kind=kind)
+    tokens = _request_tokens.get()
+    if tokens is not None:
+        tokens[kind] = tokens.get(kind, 0) + amount
+
+
+def request_tokens() -> dict[str, int]:
+    """Токены LLM, потраченные текущим запросом, по видам (prompt, completion)."""
+    return dict(_request_tokens.get() or {})
+
+
+@contextmanager
+def span(stage: str):
+    """Измеряет длительность этапа stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_stage(stage: str, duration_s: float):
+    """Записывает уже измеренную длительность этапа."""
+    STAGE_SECONDS.observe(duration_s, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, duration_s))
+
+
+def stage_totals(spans: list) -> dict[str, float]:
+    """Суммирует повторяющиеся спаны (например, попытки LLM) по имени этапа."""
+    totals: dict[str, float] = {}
+    for stage, duration_s in spans:
+        totals[stage] = totals.get(stage, 0.0) + duration_s
+    return totals
+
+
+def server_timing_header(spans: list, total_s: Optional[float] = None) -> str:
+    """Формирует значение заголовка Server-Timing (длительности в мс)."""
+    parts = [
+        f"{stage};dur={duration_s * 1000:.1f}"
+        for stage, duration_s in stage_totals(spans).items()
+    ]
+    if total_s is not None:
+        parts.append(f"total;dur={total_s * 1000:.1f}")
+    return ", ".join(parts)
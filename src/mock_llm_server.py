@@ -0,0 +1,315 @@
+"""
+Local OpenAI-compatible LLM stand-in for benchmarking src/llm_server.py offline.
+
+Serves POST /v1/chat/completions (and /chat/completions) with deterministic
+answers built from the ICD-10 codes found in the protocol context of the
+prompt, a configurable latency model, optional streaming and injectable
+faults (malformed JSON, timeouts, 5xx).
+
+Usage:
+    uv run python -m src.mock_llm_server --port 8001 --latency lognormal:median=1.5,sigma=0.6
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uv run uvicorn src.llm_server:app --port 8000
+
+Latency models (--latency / LLM_MOCK_LATENCY):
+    fixed:1.0                          — always 1.0 s
+    lognormal:median=1.5,sigma=0.5     — lognormal around the median
+    longtail:base=1.0,p=0.05,tail=10   — base, but with probability p a tail of `tail` s
+
+Faults (rates in 0..1). Latency and faults are drawn from a per-request RNG
+seeded with --seed, the prompt and how many times that prompt has been seen:
+the outcome of a request does not depend on the order in which concurrent
+requests arrive, and a retried prompt gets a fresh draw.
+    --malformed-rate / LLM_MOCK_MALFORMED_RATE  — broken JSON (truncated, fenced, trailing text)
+    --timeout-rate   / LLM_MOCK_TIMEOUT_RATE    — hang for --timeout-s before answering
+    --error-rate     / LLM_MOCK_ERROR_RATE      — 500/503 responses
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+ICD_CODE_RE = re.compile(r"\b[A-Z][0-9]{2}(?:\.[0-9]{1,2})?\b")
+CONTEXT_START = "КОНТЕКСТ ИЗ КЛИНИЧЕСКИХ ПРОТОКОЛОВ:"
+CONTEXT_END = "ЗАДАНИЕ:"
+
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0.5"
+    malformed_rate: float = 0.0
+    timeout_rate: float = 0.0
+    error_rate: float = 0.0
+    timeout_s: float = 60.0
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        return cls(
+            latency=os.getenv("LLM_MOCK_LATENCY", "fixed:0.5"),
+            malformed_rate=float(os.getenv("LLM_MOCK_MALFORMED_RATE", "0")),
+            timeout_rate=float(os.getenv("LLM_MOCK_TIMEOUT_RATE", "0")),
+            error_rate=float(os.getenv("LLM_MOCK_ERROR_RATE", "0")),
+            timeout_s=float(os.getenv("LLM_MOCK_TIMEOUT_S", "60")),
+            seed=int(os.getenv("LLM_MOCK_SEED", "0")),
+        )
+
+
+config = MockConfig.from_env()
+# Requests seen per prompt hash: the attempt number for request_rng(). An
+# LRU of MAX_TRACKED_PROMPTS hashes, so long load tests do not grow memory;
+# an evicted prompt starts again from attempt 0.
+MAX_TRACKED_PROMPTS = 4096
+_attempts: OrderedDict[str, int] = OrderedDict()
+
+
+def request_rng(prompt_hash: str) -> random.Random:
+    """RNG for one request, seeded by the seed, the prompt and the attempt number."""
+    attempt = _attempts.pop(prompt_hash, 0)
+    _attempts[prompt_hash] = attempt + 1
+    if len(_attempts) > MAX_TRACKED_PROMPTS:
+        _attempts.popitem(last=False)
+    digest = hashlib.sha256(f"{config.seed}:{prompt_hash}:{attempt}".encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def parse_latency(spec: str) -> tuple[str, dict]:
+    """Parse 'kind:a=1,b=2' (or 'fixed:1.0') into (kind, params)."""
+    kind, _, args = spec.partition(":")
+    params = {}
+    for part in filter(None, args.split(",")):
+        key, eq, value = part.partition("=")
+        if eq:
+            params[key.strip()] = float(value)
+        else:
+            params["value"] = float(key)
+    if kind not in ("fixed", "lognormal", "longtail"):
+        raise ValueError(f"Unknown latency model: {spec}")
+    return kind, params
+
+
+def sample_latency(spec: str, rng: random.Random) -> float:
+    """Draw one latency in seconds from the configured model."""
+    kind, params = parse_latency(spec)
+    if kind == "fixed":
+        return params.get("value", 0.0)
+    if kind == "lognormal":
+        median = params.get("median", 1.0)
+        sigma = params.get("sigma", 0.5)
+        return rng.lognormvariate(math.log(median), sigma)
+    base = params.get("base", 1.0)
+    if rng.random() < params.get("p", 0.05):
+        return base + params.get("tail", 10.0)
+    return base
+
+
+def extract_context(prompt: str) -> str:
+    start = prompt.find(CONTEXT_START)
+    if start == -1:
+        return prompt
+    end = prompt.find(CONTEXT_END, start)
+    return prompt[start + len(CONTEXT_START) : end if end != -1 else None]
+
+
+def build_answer(prompt: str) -> dict:
+    """Deterministic diagnoses: the most frequent ICD codes in the protocol context."""
+    context = extract_context(prompt)
+    matches = list(ICD_CODE_RE.finditer(context))
+    counts = Counter(m.group() for m in matches)
+    first_seen = {}
+    for m in matches:
+        first_seen.setdefault(m.group(), m)
+    codes = sorted(counts, key=lambda c: (-counts[c], first_seen[c].start()))[:3]
+
+    diagnoses = []
+    for rank, code in enumerate(codes, start=1):
+        # The protocol code tables read "S22.0 Перелом грудного позвонка S22.1 ...".
+        tail = context[first_seen[code].end() : first_seen[code].end() + 120]
+        name = ICD_CODE_RE.split(tail)[0].strip(" .,;:-\n") or f"Диагноз {code}"
+        diagnoses.append(
+            {
+                "rank": rank,
+                "diagnosis": name[:80],
+                "icd10_code": code,
+                "explanation": f"Код {code} встречается в контексте протоколов {counts[code]} раз(а).",
+            }
+        )
+    return {"diagnoses": diagnoses}
+
+
+def malform(content: str, rng: random.Random) -> str:
+    """Break a JSON answer the way real models do."""
+    kind = rng.choice(["truncated", "fenced", "trailing", "missing_key"])
+    if kind == "truncated":
+        return content[: max(1, int(len(content) * rng.uniform(0.3, 0.9)))]
+    if kind == "fenced":
+        return f"Вот ответ:\n```json\n{content}\n```"
+    if kind == "trailing":
+        return f"{content}\nНадеюсь, это поможет."
+    return content.replace('"diagnoses"', '"diagnosis_list"', 1)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: Optional[str] = ""
+
+
+class ChatCompletionRequest(BaseModel):
+    model: str = "mock"
+    messages: list[ChatMessage]
+    stream: Optional[bool] = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print("\n🤖 Mock LLM Server (OpenAI-compatible)")
+    print("=" * 40)
+    print("Endpoint: /v1/chat/completions")
+    print(f"Latency:  {config.latency}")
+    print(
+        f"Faults:   malformed={config.malformed_rate} timeout={config.timeout_rate} "
+        f"error={config.error_rate} seed={config.seed}"
+    )
+    print("=" * 40)
+    print("\nPress Ctrl+C to stop\n")
+    yield
+
+
+app = FastAPI(title="Mock LLM Server", lifespan=lifespan)
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def handle_chat_completions(request: ChatCompletionRequest):
+    """Handle OpenAI chat completion requests."""
+    prompt = "\n".join(m.content or "" for m in request.messages)
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    rng = request_rng(prompt_hash)
+    latency_s = sample_latency(config.latency, rng)
+    # Exactly one fault or none: consecutive ranges of a single uniform draw.
+    draw = rng.random()
+    if draw < config.error_rate:
+        fault = "error"
+    elif draw < config.error_rate + config.timeout_rate:
+        fault = "timeout"
+    elif draw < config.error_rate + config.timeout_rate + config.malformed_rate:
+        fault = "malformed"
+    else:
+        fault = None
+
+    if fault == "error":
+        await asyncio.sleep(latency_s)
+        status = rng.choice([500, 503])
+        return JSONResponse(
+            {"error": {"message": "Injected server error", "type": "server_error"}},
+            status_code=status,
+        )
+    if fault == "timeout":
+        await asyncio.sleep(config.timeout_s)
+
+    content = json.dumps(build_answer(prompt), ensure_ascii=False)
+    if fault == "malformed":
+        content = malform(content, rng)
+
+    completion_id = "chatcmpl-mock-" + prompt_hash[:16]
+    created = int(time.time())
+    usage = {
+        "prompt_tokens": estimate_tokens(prompt),
+        "completion_tokens": estimate_tokens(content),
+        "total_tokens": estimate_tokens(prompt) + estimate_tokens(content),
+    }
+
+    if request.stream:
+        return StreamingResponse(
+            stream_chunks(completion_id, created, request.model, content, latency_s),
+            media_type="text/event-stream",
+        )
+
+    await asyncio.sleep(latency_s)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": request.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": usage,
+    }
+
+
+async def stream_chunks(
+    completion_id: str, created: int, model: str, content: str, latency_s: float
+):
+    """Server-sent events: first chunk after half the latency, the rest spread evenly."""
+    pieces = [content[i : i + 16] for i in range(0, len(content), 16)] or [""]
+    first_token_s = latency_s / 2
+    per_piece_s = (latency_s - first_token_s) / len(pieces)
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+    await asyncio.sleep(first_token_s)
+    yield chunk({"role": "assistant", "content": ""})
+    for piece in pieces:
+        await asyncio.sleep(per_piece_s)
+        yield chunk({"content": piece})
+    yield chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default=config.latency)
+    parser.add_argument("--malformed-rate", type=float, default=config.malformed_rate)
+    parser.add_argument("--timeout-rate", type=float, default=config.timeout_rate)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--timeout-s", type=float, default=config.timeout_s)
+    parser.add_argument("--seed", type=int, default=config.seed)
+    args = parser.parse_args()
+
+    parse_latency(args.latency)
+    config.latency = args.latency
+    config.malformed_rate = args.malformed_rate
+    config.timeout_rate = args.timeout_rate
+    config.error_rate = args.error_rate
+    config.timeout_s = args.timeout_s
+    config.seed = args.seed
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Устойчивый разбор ответа LLM со списком диагнозов.
+
+Вместо того чтобы выбрасывать весь ответ при первой ошибке json.loads,
+parse_diagnoses() пытается его спасти:
+    - достаёт JSON из блоков ```json ... ``` и из текста вокруг него;
+    - достраивает обрезанный JSON до последнего целого элемента;
+    - находит список диагнозов и под другим ключом;
+    - приводит rank к int, заполняет отсутствующие поля;
+    - нормализует коды МКБ-10 и сверяет их с индексом кодов протоколов
+      (коды вне индекса опускаются в конец списка).
+
+Если спасти ответ не удалось, бросается DiagnosesParseError, и сервер
+переспрашивает модель коротким промптом на исправление
+(build_repair_prompt), а не повторяет полный запрос.
+
+Индекс кодов строит rag/ingest.py в каталоге версии индекса; он читается
+из версии, на которой работает сервер, а без манифеста (или для версии без
+индекса кодов) — из ICD_CODE_INDEX (по умолчанию ./icd_codes.json, см.
+rag/build_code_index.py). Без индекса проверяется только формат кода.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from src.index_versions import served_spec
+from src.metrics import Counter
+
+ICD_CODE_INDEX = os.getenv("ICD_CODE_INDEX", "./icd_codes.json")
+
+ICD_CODE_RE = re.compile(r"^[A-Z][0-9]{2}(?:\.[0-9]{1,2})?$")
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+# Кириллические буквы, которые модель иногда ставит вместо латинских в кодах.
+_CYRILLIC_TO_LATIN = str.maketrans("АВСЕНКМОРТХ", "ABCEHKMOPTX")
+
+CODE_KEYS = ("icd10_code", "icd10", "icd_code", "icd", "code", "mkb10", "mkb")
+NAME_KEYS = ("diagnosis", "name", "title", "disease")
+EXPLANATION_KEYS = ("explanation", "reason", "rationale", "justification")
+
+PARSE_OUTCOMES = Counter(
+    "llm_parse_total",
+    "Результаты разбора ответов LLM: clean, salvaged, repaired, failed.",
+    ["outcome"],
+)
+UNKNOWN_CODES = Counter(
+    "llm_unknown_codes_total",
+    "Коды МКБ-10 из ответов LLM, которых нет в индексе протоколов.",
+)
+
+
+class DiagnosesParseError(ValueError):
+    """Ответ LLM не удалось превратить в список диагнозов."""
+
+
+@dataclass
+class ParseResult:
+    diagnoses: list[dict]
+    salvaged: bool
+
+
+def load_code_index() -> frozenset:
+    """Множество кодов МКБ-10 из протоколов текущей версии индекса или ICD_CODE_INDEX."""
+    spec = served_spec()
+    return read_code_index((spec and spec.code_index_path) or ICD_CODE_INDEX)
+
+
+@lru_cache(maxsize=2)
+def read_code_index(path: str) -> frozenset:
+    """Коды из файла индекса (пустое множество, если файла нет)."""
+    if not path or not os.path.exists(path):
+        return frozenset()
+    with open(path, "r", encoding="utf-8") as f:
+        return frozenset(json.load(f))
+
+
+def normalize_code(value) -> str:
+    code = str(value or "").strip().upper().translate(_CYRILLIC_TO_LATIN)
+    code = code.replace(",", ".").replace(" ", "").rstrip(".")
+    # "J209" -> "J20.9"
+    if re.fullmatch(r"[A-Z][0-9]{3,4}", code):
+        code = f"{code[:3]}.{code[3:]}"
+    return code
+
+
+def _close_truncated(text: str) -> Optional[object]:
+    """Достраивает обрезанный JSON: откатывается к последнему целому элементу и закрывает скобки."""
+    stack: list[str] = []
+    in_string = False
+    escaped = False
+    # (позиция среза, открытые скобки на этот момент)
+    cut_points: list[tuple[int, str]] = []
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, "".join(reversed(stack))))
+            if not stack:
+                break
+        elif ch == ",":
+            cut_points.append((i, "".join(reversed(stack))))
+
+    for pos, closers in reversed(cut_points[-50:]):
+        try:
+            return json.loads(text[:pos] + closers)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def extract_json(text: str) -> tuple[object, bool]:
+    """Возвращает (объект, salvaged); salvaged=True, если JSON пришлось доставать или чинить."""
+    text = (text or "").strip()
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    candidates = [m.group(1).strip() for m in _FENCE_RE.finditer(text)]
+    candidates.append(text)
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        start = candidate.find("{")
+        if start == -1:
+            continue
+        try:
+            return decoder.raw_decode(candidate[start:])[0], True
+        except json.JSONDecodeError:
+            pass
+        repaired = _close_truncated(candidate[start:])
+        if repaired is not None:
+            return repaired, True
+    raise DiagnosesParseError("в ответе нет разбираемого JSON")
+
+
+def _nested_lists(data):
+    """Пары (ключ, список) словаря: сначала его собственные, затем вложенных словарей."""
+    if not isinstance(data, dict):
+        return
+    for key, value in data.items():
+        if isinstance(value, list):
+            yield key, value
+    for value in data.values():
+        if isinstance(value, dict):
+            yield from _nested_lists(value)
+
+
+def _find_diagnoses_list(data) -> Optional[list]:
+    """Список под ключом "diagnoses" на любой глубине, иначе первый непустой
+    список объектов; пустой список — только если другого нет."""
+    if isinstance(data, list):
+        return data
+    lists = list(_nested_lists(data))
+    for key, value in lists:
+        if key == "diagnoses":
+            return value
+    objects = [value for _, value in lists if all(isinstance(v, dict) for v in value)]
+    for value in objects:
+        if value:
+            return value
+    return objects[0] if objects else None
+
+
+def _first(item: dict, keys) -> Optional[str]:
+    for key in keys:
+        if item.get(key) not in (None, ""):
+            return item[key]
+    return None
+
+
+def _coerce_rank(value, default: int) -> int:
+    match = re.search(r"\d+", str(value)) if value is not None else None
+    return int(match.group()) if match else default
+
+
+def _is_exact(item: dict, diagnosis: dict) -> bool:
+    """Элемент уже был в формате Diagnosis: ничего не пришлось заполнять или приводить."""
+    return (
+        isinstance(item.get("rank"), int)
+        and item.get("icd10_code") == diagnosis["icd10_code"]
+        and item.get("diagnosis") == diagnosis["diagnosis"]
+        and isinstance(item.get("explanation"), str)
+    )
+
+
+def coerce_diagnoses(items: list, code_index: frozenset) -> tuple[list[dict], bool]:
+    """Приводит элементы к полям Diagnosis, отбрасывает элементы без валидного кода.
+
+    Возвращает (диагнозы, changed); changed=True, если какой-то элемент
+    пришлось дополнить, привести или отбросить.
+    """
+    valid, unknown = [], []
+    changed = False
+    for position, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            changed = True
+            continue
+        code = normalize_code(_first(item, CODE_KEYS))
+        if not ICD_CODE_RE.match(code):
+            changed = True
+            continue
+        diagnosis = {
+            "rank": _coerce_rank(item.get("rank"), position),
+            "diagnosis": str(_first(item, NAME_KEYS) or code),
+            "icd10_code": code,
+            "explanation": str(_first(item, EXPLANATION_KEYS) or ""),
+        }
+        changed = changed or not _is_exact(item, diagnosis)
+        if code_index and code not in code_index and code[:3] not in code_index:
+            UNKNOWN_CODES.inc()
+            unknown.append(diagnosis)
+        else:
+            valid.append(diagnosis)
+
+    valid.sort(key=lambda d: d["rank"])
+    unknown.sort(key=lambda d: d["rank"])
+    diagnoses = valid + unknown
+    for rank, diagnosis in enumerate(diagnoses, start=1):
+        diagnosis["rank"] = rank
+    return diagnoses, changed
+
+
+def parse_diagnoses(text: str, code_index: Optional[frozenset] = None) -> ParseResult:
+    """Разбирает ответ LLM; бросает DiagnosesParseError, если спасти не удалось."""
+    if code_index is None:
+        code_index = load_code_index()
+    data, salvaged = extract_json(text)
+    items = _find_diagnoses_list(data)
+    if items is None:
+        raise DiagnosesParseError("в JSON нет списка диагнозов")
+    if not isinstance(data, dict) or "diagnoses" not in data:
+        salvaged = True
+    diagnoses, changed = coerce_diagnoses(items, code_index)
+    if items and not diagnoses:
+        raise DiagnosesParseError("ни у одного диагноза нет корректного кода МКБ-10")
+    salvaged = salvaged or changed
+    return ParseResult(diagnoses=diagnoses, salvaged=salvaged)
+
+
+def build_repair_prompt(broken_output: str, error: str, max_chars: int = 4000) -> str:
+    """Короткий промпт на исправление: без контекста протоколов, только сломанный ответ."""
+    return f"""Следующий ответ должен был быть JSON со списком диагнозов, но его не удалось разобрать ({error}).
+Исправьте его и верните СТРОГО JSON без дополнительного текста в формате:
+{{"diagnoses": [{{"rank": 1, "diagnosis": "...", "icd10_code": "X00.0", "explanation": "..."}}]}}
+
+ОТВЕТ:
+{broken_output[:max_chars]}
+"""
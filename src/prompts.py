@@ -0,0 +1,61 @@
+"""
+Промпты для LLM.
+
+build_prompt() собирает пользовательский промпт /diagnose из симптомов,
+данных пациента и контекста из протоколов. Вынесен из src/llm_server.py,
+чтобы сборку промпта можно было измерять отдельно (bench/).
+"""
+
+SYSTEM_PROMPT = "Вы — система поддержки принятия клинических решений. Ваша задача — помочь в диагностике заболеваний на основе предоставленных данных. Ответ должен быть в формате JSON."
+
+
+def build_prompt(symptoms: str, patient_data, context_str: str) -> str:
+    """Промпт с данными пациента и контекстом; patient_data — PatientData или None."""
+    prompt = f"""Вы — система поддержки принятия клинических решений, обученная на казахстанских клинических протоколах.
+Ваша задача — проанализировать симптомы и данные пациента, сопоставить их с информацией из клинических протоколов и предложить до 3 наиболее вероятных диагнозов с кодами по МКБ-10.
+
+ПАЦИЕНТ:
+- Симптомы: {symptoms}
+"""
+    if patient_data:
+        prompt += f"- Возраст: {patient_data.age}\n" if patient_data.age else ""
+        prompt += f"- Пол: {patient_data.gender}\n" if patient_data.gender else ""
+        if patient_data.medicalHistory:
+            prompt += f"- История болезни: {', '.join(patient_data.medicalHistory)}\n"
+        if patient_data.currentMedications:
+            prompt += f"- Текущие препараты: {', '.join(patient_data.currentMedications)}\n"
+        if patient_data.allergies:
+            prompt += f"- Аллергии: {', '.join(patient_data.allergies)}\n"
+        if patient_data.recentLabs:
+            prompt += "- Последние анализы:\n"
+            for lab in patient_data.recentLabs:
+                prompt += f"  - {lab['name']}: {lab['value']} {lab['unit']} (норма: {lab['normalRange']})\n"
+        if patient_data.previousDiagnoses:
+            prompt += "- Предыдущие диагнозы:\n"
+            for diag in patient_data.previousDiagnoses:
+                prompt += f"  - {diag['diagnosis']} ({diag['date']})\n"
+
+    prompt += f"""
+КОНТЕКСТ ИЗ КЛИНИЧЕСКИХ ПРОТОКОЛОВ:
+{context_str}
+
+ЗАДАНИЕ:
+1.  Проанализируйте предоставленную информацию.
+2.  Определите 3 наиболее вероятных диагноза.
+3.  Для каждого диагноза укажите его название, код по МКБ-10 и краткое, но профессиональное обоснование, почему этот диагноз может быть релевантен, основываясь на симптомах, данных пациента и контексте из протоколов.
+4.  Ответ верните СТРОГО в формате JSON, без какого-либо дополнительного текста.
+
+ФОРМАТ ОТВЕТА (JSON):
+{{
+  "diagnoses": [
+    {{
+      "rank": 1,
+      "diagnosis": "Название диагноза",
+      "icd10_code": "X00.0",
+      "explanation": "Обоснование..."
+    }},
+    ...
+  ]
+}}
+"""
+    return prompt
@@ -0,0 +1,199 @@
+"""
+Отдельный процесс поиска по протоколам для многопроцессного режима.
+
+Модель e5-large и локальная база Qdrant загружаются один раз в этом
+процессе; воркеры uvicorn подключаются к нему по Unix-сокету (см.
+RETRIEVER_SOCKET в src/retriever.py) и не держат собственных копий
+модели и индекса. Одновременные запросы объединяются в батчи для
+эмбеддинга; батчи считаются в пуле из RETRIEVAL_EMBED_THREADS потоков,
+поиск выполняется в отдельном пуле.
+
+Использование:
+    uv run python -m src.retrieval_worker --socket /tmp/qazcode-retriever.sock
+    RETRIEVER_SOCKET=/tmp/qazcode-retriever.sock \\
+        uv run uvicorn src.llm_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Протокол: одна строка JSON на запрос и одна на ответ.
+    -> {"query": "...", "k": 10, "patient": {"age": 42, "gender": "female"}}
+    <- {"documents": [{"page_content": "...", "metadata": {...}}, ...],
+        "timings": {"worker_queue": 0.001, "embed": 0.05, "search": 0.01},
+        "index_version": "20260101-120000-3f9a1c"}
+    -> {"op": "reload"}
+    <- {"version": "...", "previous": "...", "changed": true}
+    <- {"error": "..."}
+
+Версии индекса переключаются без остановки процесса (src/index_versions.py):
+по {"op": "reload"} или, при INDEX_WATCH_S > 0, по изменению манифеста.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.index_versions import INDEX_WATCH_S, watch_manifest
+from src.retriever import (
+    RETRIEVER_SOCKET,
+    assign_owners,
+    get_embeddings,
+    index_manager,
+    search_index,
+)
+
+MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "16"))
+BATCH_WAIT_S = float(os.getenv("RETRIEVAL_BATCH_WAIT_MS", "2")) / 1000
+SEARCH_THREADS = int(os.getenv("RETRIEVAL_SEARCH_THREADS", "4"))
+# Батчей в работе одновременно. Один поток хорош на GPU и когда torch сам
+# занимает все ядра; на многоядерном CPU несколько потоков (с меньшим
+# torch.set_num_threads) дают больше запросов в секунду под нагрузкой.
+EMBED_THREADS = int(os.getenv("RETRIEVAL_EMBED_THREADS", "1"))
+
+
+class RetrievalWorker:
+    def __init__(self):
+        self.embeddings = get_embeddings()
+        index_manager.current()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Эмбеддинг и поиск — в разных пулах, чтобы поиск не стоял за
+        # эмбеддингом. Пока все потоки эмбеддинга заняты, запросы копятся
+        # в очереди и уходят следующим батчем.
+        self.embed_executor = ThreadPoolExecutor(max_workers=EMBED_THREADS)
+        self.embed_slots = asyncio.Semaphore(EMBED_THREADS)
+        self.embed_tasks: set[asyncio.Task] = set()
+        self.search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS)
+        # Прогрев: первый вызов модели заметно медленнее последующих.
+        self._embed(["warm-up"])
+
+    def _embed(self, queries: list[str]) -> list[list[float]]:
+        if len(queries) == 1:
+            return [self.embeddings.embed_query(queries[0])]
+        return self.embeddings.embed_documents(queries)
+
+    def _search(self, vector, k: int, patient):
+        # Запрос дорабатывает на той версии индекса, на которой начался.
+        with index_manager.acquire() as index:
+            return index.version, search_index(index.vectorstore, vector, k, patient)
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.embed_slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WAIT_S
+            while len(batch) < MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._embed_batch(batch))
+            self.embed_tasks.add(task)
+            task.add_done_callback(self.embed_tasks.discard)
+
+    async def _embed_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self.embed_executor, self._embed, [item[0] for item in batch]
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.embed_slots.release()
+        embed_s = time.perf_counter() - start
+        for (_, enqueued_at, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result((vector, start - enqueued_at, embed_s))
+
+    async def search(self, query: str, k: int, patient=None) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((query, time.perf_counter(), future))
+        vector, queue_s, embed_s = await future
+
+        start = time.perf_counter()
+        version, docs = await asyncio.get_running_loop().run_in_executor(
+            self.search_executor, self._search, vector, k, patient
+        )
+        return {
+            "documents": [
+                {"page_content": doc.page_content, "metadata": doc.metadata}
+                for doc in assign_owners(docs)
+            ],
+            "timings": {
+                "worker_queue": queue_s,
+                "embed": embed_s,
+                "search": time.perf_counter() - start,
+            },
+            "index_version": version,
+        }
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if request.get("op") == "reload":
+                        result = await asyncio.to_thread(index_manager.reload)
+                    else:
+                        result = await self.search(
+                            request["query"], int(request["k"]), request.get("patient")
+                        )
+                except Exception as e:
+                    result = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(result, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(socket_path: str):
+    worker = RetrievalWorker()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(
+        worker.handle_connection, path=socket_path, limit=2**20
+    )
+    batch_task = asyncio.create_task(worker.batch_loop())
+    watch_task = None
+    if INDEX_WATCH_S > 0:
+        watch_task = asyncio.create_task(watch_manifest(index_manager))
+    print(f"Сервис поиска слушает {socket_path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        if watch_task is not None:
+            watch_task.cancel()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервис поиска по протоколам")
+    parser.add_argument(
+        "--socket",
+        default=RETRIEVER_SOCKET or "/tmp/qazcode-retriever.sock",
+        help="Путь к Unix-сокету (по умолчанию $RETRIEVER_SOCKET)",
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,188 @@
-from langchain_qdrant import QdrantVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
-from qdrant_client import QdrantClient
+import asyncio
+import json
+import os
+import threading
+
+from src.index_versions import IndexManager, IndexSpec, note_version
+from src.metrics import record_stage, span
+
+# langchain/qdrant/torch are imported lazily in get_embeddings() and
+# _open_index(): importing this module must stay cheap, and API workers in
+# multi-worker mode never load them at all.
 
 QDRANT_PATH = "./qdrant_db"
 COLLECTION_NAME = "protocols-multilingual-e5-large"
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+# If set, retrieval goes to src.retrieval_worker over this Unix socket instead
+# of loading the model and the index in this process (multi-worker mode).
+RETRIEVER_SOCKET = os.getenv("RETRIEVER_SOCKET")
+# Rank chunks tagged for another age group/sex (see rag/tagging.py) lower:
+# each mismatching tag costs PATIENT_PENALTY of similarity, so a protocol
+# that fits the query well is never excluded. Off by default until
+# rag/evaluate_retriever.py shows no recall loss.
+PATIENT_FILTERS = os.getenv("PATIENT_FILTERS", "0") == "1"
+PATIENT_PENALTY = float(os.getenv("PATIENT_PENALTY", "0.02"))
+# Candidates searched per requested chunk when re-ranking for a patient; no
+# payload filter is used, embedded Qdrant would scan every payload for it.
+PATIENT_OVERFETCH = 3
+ADULT_AGE = 18
+
+FEMALE_VALUES = {"f", "female", "woman", "ж", "жен", "женский", "женщина"}
+MALE_VALUES = {"m", "male", "man", "м", "муж", "мужской", "мужчина"}
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings():
+    # One model per process, shared by all index versions.
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            from langchain_huggingface import HuggingFaceEmbeddings
+
+            _embeddings = HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL,
+                # safetensors weights are memory-mapped instead of copied; the
+                # device is left to sentence-transformers (GPU when available).
+                model_kwargs={"model_kwargs": {"use_safetensors": True}},
+            )
+        return _embeddings
+
+def _open_index(spec):
+    with span("retriever_init"):
+        from langchain_qdrant import QdrantVectorStore
+
+        return QdrantVectorStore.from_existing_collection(
+            embedding=get_embeddings(),
+            path=spec.qdrant_path,
+            collection_name=spec.collection,
+        )
 
-def get_retriever(k=3):
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    vectorstore = QdrantVectorStore.from_existing_collection(
-        embedding=embeddings,
-        path=QDRANT_PATH,
-        collection_name=COLLECTION_NAME,
+# Versioned indexes from the manifest written by rag/ingest.py, or the fixed
+# QDRANT_PATH if there is none (see src/index_versions.py).
+index_manager = IndexManager(_open_index, IndexSpec("default", QDRANT_PATH, COLLECTION_NAME))
+
+def patient_mismatch(patient=None):
+    """Tag values that do not fit the patient, e.g. {"age_group": "adult"}.
+
+    `patient` is a dict with optional "age" and "gender"; None if neither
+    is known. Chunks tagged "all" or untagged never match these values.
+    """
+    if not patient:
+        return None
+    mismatch = {}
+    age = patient.get("age")
+    if age is not None:
+        mismatch["age_group"] = "adult" if age < ADULT_AGE else "pediatric"
+    gender = str(patient.get("gender") or "").strip().lower()
+    if gender in FEMALE_VALUES or gender in MALE_VALUES:
+        mismatch["sex"] = "male" if gender in FEMALE_VALUES else "female"
+    return mismatch or None
+
+def rank_for_patient(docs_with_scores, mismatch, k):
+    """Top-k documents after down-weighting those tagged for another age group or sex."""
+
+    def score(item):
+        doc, similarity = item
+        penalties = sum(1 for field, value in mismatch.items() if doc.metadata.get(field) == value)
+        return similarity - penalties * PATIENT_PENALTY
+
+    return [doc for doc, _ in sorted(docs_with_scores, key=score, reverse=True)[:k]]
+
+def search_index(vectorstore, vector, k, patient=None):
+    """Top-k chunks for a query vector, re-ranked for the patient if PATIENT_FILTERS is on."""
+    mismatch = patient_mismatch(patient) if PATIENT_FILTERS else None
+    if mismatch is None:
+        return vectorstore.similarity_search_by_vector(vector, k=k)
+    candidates = vectorstore.similarity_search_with_score_by_vector(
+        vector, k=k * PATIENT_OVERFETCH
     )
-    return vectorstore.as_retriever(search_kwargs={"k": k})
+    return rank_for_patient(candidates, mismatch, k)
+
+def assign_owners(docs):
+    """Attributes every passage stored once for several protocols to one of them.
+
+    Deduplicated chunks (rag/dedup.py) list all owners in "source_files", in
+    alphabetical order. Such a chunk keeps its single rank position and gets
+    the owner whose own chunk ranks highest in `docs` as "source_file"; if
+    no other owner was retrieved, it keeps the protocol it was stored from.
+    """
+    best_rank = {}
+    for rank, doc in enumerate(docs):
+        if len(doc.metadata.get("source_files") or ()) <= 1:
+            best_rank.setdefault(doc.metadata.get("source_file"), rank)
+    for doc in docs:
+        ranked = [o for o in doc.metadata.get("source_files") or () if o in best_rank]
+        if ranked:
+            doc.metadata["source_file"] = min(ranked, key=best_rank.get)
+    return docs
+
+def get_retriever(k=3, patient=None):
+    # Every call goes through retrieve(): the index version is held only for
+    # the duration of one search and may be swapped between calls.
+    from langchain_core.runnables import RunnableLambda
+
+    return RunnableLambda(lambda query: retrieve(query, k=k, patient=patient))
+
+def retrieve(query, k=3, patient=None):
+    """Top-k chunks for a query, with embedding and search timed separately."""
+    with index_manager.acquire() as index:
+        with span("embed"):
+            vector = index.vectorstore.embeddings.embed_query(query)
+        with span("search"):
+            docs = search_index(index.vectorstore, vector, k, patient)
+    return assign_owners(docs)
+
+async def _worker_request(request):
+    """One JSON line to the retrieval worker and its JSON reply."""
+    reader, writer = await asyncio.open_unix_connection(RETRIEVER_SOCKET, limit=2**20)
+    try:
+        writer.write(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+
+    if not line:
+        raise ConnectionError(f"Retrieval worker at {RETRIEVER_SOCKET} closed the connection")
+    result = json.loads(line)
+    if "error" in result:
+        raise RuntimeError(f"Retrieval worker error: {result['error']}")
+    return result
+
+async def aretrieve(query, k=3, patient=None):
+    """Async retrieve: via the retrieval worker if RETRIEVER_SOCKET is set, else in a thread."""
+    if not RETRIEVER_SOCKET:
+        return await asyncio.to_thread(retrieve, query, k, patient)
+
+    from langchain_core.documents import Document
+
+    result = await _worker_request({"query": query, "k": k, "patient": patient})
+    for stage, duration_s in result.get("timings", {}).items():
+        record_stage(stage, duration_s)
+    note_version(result.get("index_version"))
+    return [Document(**doc) for doc in result["documents"]]
+
+async def reload_index():
+    """Switches to the index version in the manifest (in the retrieval worker if there is one)."""
+    if RETRIEVER_SOCKET:
+        result = await _worker_request({"op": "reload"})
+    else:
+        result = await asyncio.to_thread(index_manager.reload)
+    note_version(result["version"])
+    return result
+
+def prefetch_model():
+    """Download the embedding model weights (safetensors only) into the HF cache."""
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(
+        EMBEDDING_MODEL,
+        allow_patterns=["*.json", "*.txt", "*.model", "*.safetensors", "1_Pooling/*"],
+    )
+
+if __name__ == "__main__":
+    # Run once in the server's environment (e.g. as an image build step):
+    # `python -m src.retriever` caches the model weights so the server can
+    # start with HF_HUB_OFFLINE=1 and no downloads.
+    print(prefetch_model())
@@ -0,0 +1,71 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src import digests, index_versions
+
+
+def doc(source_file, text):
+    return SimpleNamespace(page_content=text, metadata={"source_file": source_file})
+
+
+@pytest.fixture
+def digest_file(monkeypatch):
+    entries = {
+        "a.pdf": {"digest": "A" * 300},
+        "b.pdf": {"digest": "B" * 300},
+        "c.pdf": {"digest": "C" * 5000},
+    }
+    monkeypatch.setattr(digests, "load_digests", lambda: entries)
+
+
+def test_digests_replace_chunks_within_budget(digest_file):
+    docs = [doc("a.pdf", "a" * 400), doc("b.pdf", "b" * 400), doc("a.pdf", "x" * 400)]
+    context = digests.digest_context(docs)
+    assert context == "A" * 300 + "\n\n" + "B" * 300
+    assert len(context) <= len(digests.chunk_context(docs))
+
+
+def test_stops_before_exceeding_chunk_context(digest_file):
+    docs = [doc("a.pdf", "a" * 400), doc("c.pdf", "c" * 400)]
+    assert digests.digest_context(docs) == "A" * 300
+
+
+def test_falls_back_to_chunks_when_no_digest_fits(digest_file):
+    docs = [doc("c.pdf", "c" * 400), doc("a.pdf", "a" * 400)]
+    assert digests.digest_context(docs) == digests.chunk_context(docs)
+
+
+def test_max_chars(digest_file):
+    docs = [doc("a.pdf", "a" * 400), doc("b.pdf", "b" * 400)]
+    assert digests.digest_context(docs, max_chars=400) == "A" * 300
+
+
+def test_protocol_without_digest_keeps_its_chunks(digest_file):
+    docs = [doc("a.pdf", "a" * 400), doc("d.pdf", "d1"), doc("d.pdf", "d2"), doc("d.pdf", "d1")]
+    assert digests.digest_context(docs) == "A" * 300 + "\n\nd1\n\nd2"
+
+
+def test_digests_follow_the_served_version(tmp_path, monkeypatch):
+    versions = {}
+    for version in ("v1", "v2"):
+        (tmp_path / version).mkdir()
+        (tmp_path / version / "digests.json").write_text(
+            json.dumps({"protocols": {f"{version}.pdf": {"digest": version}}})
+        )
+        versions[version] = {
+            "qdrant_path": f"{version}/qdrant",
+            "collection": "protocols",
+            "digests": f"{version}/digests.json",
+        }
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"current": "v2", "versions": versions}))
+    monkeypatch.setattr(index_versions, "INDEX_MANIFEST", str(manifest))
+    monkeypatch.setattr(index_versions, "_seen_version", "v1")
+    index_versions._published_spec.cache_clear()
+
+    assert list(digests.load_digests()) == ["v1.pdf"]
+    index_versions.note_version("v2")
+    assert list(digests.load_digests()) == ["v2.pdf"]
+    index_versions._published_spec.cache_clear()
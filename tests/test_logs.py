@@ -0,0 +1,37 @@
+import json
+import logging
+import queue
+
+from src import logs
+from src.logs import JsonFormatter, _Listener, _NonBlockingQueueHandler
+
+
+def test_exception_survives_the_queue():
+    log_queue = queue.Queue()
+    logger = logging.getLogger("diag.test_logs")
+    logger.handlers = [_NonBlockingQueueHandler(log_queue)]
+    logger.propagate = False
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("ошибка %s", 42)
+
+    payload = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert payload["msg"] == "ошибка 42"
+    assert payload["exc"].startswith("Traceback")
+    assert "ZeroDivisionError" in payload["exc"]
+
+
+def test_stop_sentinel_fits_into_a_full_queue(monkeypatch):
+    monkeypatch.setattr(logs, "SHUTDOWN_WAIT_S", 0.01)
+    log_queue = queue.Queue(maxsize=2)
+    for i in range(2):
+        log_queue.put_nowait(logging.makeLogRecord({"msg": str(i)}))
+    listener = _Listener(log_queue, logging.NullHandler())
+
+    # Поток вывода не запущен, так что место в очереди никто не освобождает.
+    listener.enqueue_sentinel()
+
+    items = [log_queue.get_nowait() for _ in range(log_queue.qsize())]
+    assert items[-1] is listener._sentinel
+    assert [r.msg for r in items[:-1]] == ["1"]
@@ -0,0 +1,121 @@
+import pytest
+
+from src.parsing import DiagnosesParseError, normalize_code, parse_diagnoses
+
+NO_INDEX = frozenset()
+
+
+def test_clean_json_is_not_salvaged():
+    result = parse_diagnoses(
+        '{"diagnoses": [{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9",'
+        ' "explanation": "кашель"}]}',
+        NO_INDEX,
+    )
+    assert not result.salvaged
+    assert result.diagnoses == [
+        {"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9", "explanation": "кашель"}
+    ]
+
+
+def test_fenced_output_with_surrounding_text():
+    text = (
+        "Вот ответ:\n```json\n"
+        '{"diagnoses": [{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9"}]}\n'
+        "```\nНадеюсь, это поможет."
+    )
+    result = parse_diagnoses(text, NO_INDEX)
+    assert result.salvaged
+    assert [d["icd10_code"] for d in result.diagnoses] == ["J20.9"]
+    assert result.diagnoses[0]["explanation"] == ""
+
+
+def test_truncated_json_keeps_complete_items():
+    text = (
+        '{"diagnoses": [{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9"},'
+        ' {"rank": 2, "diagnosis": "Пневмония", "icd10_code": "J18.9"},'
+        ' {"rank": 3, "diagnosis": "Трахе'
+    )
+    result = parse_diagnoses(text, NO_INDEX)
+    assert result.salvaged
+    assert [d["icd10_code"] for d in result.diagnoses] == ["J20.9", "J18.9"]
+
+
+def test_renamed_keys():
+    text = (
+        '{"results": [{"rank": "2", "name": "Пневмония", "icd": "J18.9", "reason": "хрипы"},'
+        ' {"rank": "1", "title": "Бронхит", "code": "J20.9"}]}'
+    )
+    result = parse_diagnoses(text, NO_INDEX)
+    assert result.salvaged
+    assert result.diagnoses == [
+        {"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9", "explanation": ""},
+        {"rank": 2, "diagnosis": "Пневмония", "icd10_code": "J18.9", "explanation": "хрипы"},
+    ]
+
+
+def test_diagnoses_key_wins_over_other_lists():
+    text = (
+        '{"notes": [], "sources": [{"file": "a.pdf"}],'
+        ' "diagnoses": [{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9"}]}'
+    )
+    result = parse_diagnoses(text, NO_INDEX)
+    assert [d["icd10_code"] for d in result.diagnoses] == ["J20.9"]
+
+
+def test_empty_list_does_not_hide_renamed_list():
+    text = '{"notes": [], "results": [{"rank": 1, "name": "Бронхит", "code": "J20.9"}]}'
+    result = parse_diagnoses(text, NO_INDEX)
+    assert result.salvaged
+    assert [d["icd10_code"] for d in result.diagnoses] == ["J20.9"]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"diagnoses": [{"icd10_code": "J20.9"}]}',
+        '[{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9", "explanation": ""}]',
+        '{"diagnoses": [{"rank": "1", "diagnosis": "Бронхит", "icd10_code": "J20.9",'
+        ' "explanation": ""}]}',
+        '{"diagnoses": [{"rank": 1, "diagnosis": "Бронхит", "icd10_code": "j209",'
+        ' "explanation": ""}]}',
+    ],
+    ids=["missing-fields", "bare-list", "string-rank", "normalized-code"],
+)
+def test_coerced_items_count_as_salvaged(text):
+    result = parse_diagnoses(text, NO_INDEX)
+    assert result.salvaged
+    assert result.diagnoses[0]["icd10_code"] == "J20.9"
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("j209", "J20.9"),
+        ("J20.9", "J20.9"),
+        (" j20,9. ", "J20.9"),
+        ("Е11.9", "E11.9"),  # кириллическая Е
+        ("I2511", "I25.11"),
+        ("J20", "J20"),
+    ],
+)
+def test_normalize_code(raw, expected):
+    assert normalize_code(raw) == expected
+
+
+def test_unknown_codes_go_last():
+    text = (
+        '{"diagnoses": [{"rank": 1, "diagnosis": "A", "icd10_code": "Z99.9"},'
+        ' {"rank": 2, "diagnosis": "B", "icd10_code": "j209"}]}'
+    )
+    result = parse_diagnoses(text, frozenset({"J20.9"}))
+    assert [(d["rank"], d["icd10_code"]) for d in result.diagnoses] == [(1, "J20.9"), (2, "Z99.9")]
+
+
+def test_invalid_codes_are_dropped():
+    with pytest.raises(DiagnosesParseError):
+        parse_diagnoses('{"diagnoses": [{"rank": 1, "icd10_code": "не знаю"}]}', NO_INDEX)
+
+
+def test_no_json():
+    with pytest.raises(DiagnosesParseError):
+        parse_diagnoses("Не могу поставить диагноз.", NO_INDEX)
@@ -0,0 +1,24 @@
+from types import SimpleNamespace
+
+from src.retriever import assign_owners
+
+
+def doc(source_file, owners=None):
+    metadata = {"source_file": source_file}
+    if owners:
+        metadata["source_files"] = owners
+    return SimpleNamespace(page_content="", metadata=metadata)
+
+
+def test_shared_chunk_goes_to_best_ranked_owner():
+    docs = [
+        doc("a.pdf", owners=["a.pdf", "b.pdf", "c.pdf"]),
+        doc("c.pdf"),
+        doc("b.pdf"),
+    ]
+    assert [d.metadata["source_file"] for d in assign_owners(docs)] == ["c.pdf", "c.pdf", "b.pdf"]
+
+
+def test_shared_chunk_keeps_one_rank_position():
+    docs = [doc("b.pdf", owners=["a.pdf", "b.pdf", "c.pdf"]), doc("d.pdf")]
+    assert [d.metadata["source_file"] for d in assign_owners(docs)] == ["b.pdf", "d.pdf"]